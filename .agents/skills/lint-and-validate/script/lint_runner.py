@@ -4,18 +4,30 @@ Lint Runner - Unified linting and type checking
 Runs appropriate linters based on project type.
 
 Usage:
-    python lint_runner.py <project_path>
+    python lint_runner.py <project_path> [--changed] [--jobs N] [--timeout S] [--no-cache]
 
 Supports:
     - Node.js: npm run lint, npx tsc --noEmit
     - Python: ruff check, mypy
+
+Independent linters run concurrently and stream their output as it arrives.
+Results are cached in .lint_cache.json keyed by a hash of the tracked inputs,
+so an unchanged tree returns immediately. --changed lints only the files git
+reports as modified or untracked; `npm run lint` and whole-program checkers
+(tsc) still run on the full project.
 """
 
+import argparse
+import hashlib
 import subprocess
 import sys
 import json
+import os
 import platform
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -25,6 +37,21 @@ try:
 except:
     pass
 
+CACHE_FILE = ".lint_cache.json"
+CACHE_VERSION = 1
+DEFAULT_TIMEOUT = 120
+SKIP_DIRS = {"node_modules", ".git", "venv", ".venv", "__pycache__", "dist", "build"}
+JS_EXTENSIONS = (".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs")
+PY_EXTENSIONS = (".py",)
+
+_print_lock = threading.Lock()
+
+
+def log(line: str):
+    """Print from any worker thread without interleaving lines."""
+    with _print_lock:
+        print(line, flush=True)
+
 
 def detect_project_type(project_path: Path) -> dict:
     """Detect project type and available linters."""
@@ -32,7 +59,7 @@ def detect_project_type(project_path: Path) -> dict:
         "type": "unknown",
         "linters": []
     }
-    
+
     # Node.js project
     package_json = project_path / "package.json"
     if package_json.exists():
@@ -41,93 +68,287 @@ def detect_project_type(project_path: Path) -> dict:
             pkg = json.loads(package_json.read_text(encoding='utf-8'))
             scripts = pkg.get("scripts", {})
             deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
-            
-            # Check for lint script
+
+            # Check for lint script. No changed_cmd: a typical "eslint ." script
+            # would still lint the whole tree with extra paths appended.
             if "lint" in scripts:
-                result["linters"].append({"name": "npm lint", "cmd": ["npm", "run", "lint"]})
+                result["linters"].append({
+                    "name": "npm lint",
+                    "cmd": ["npm", "run", "lint"],
+                    "extensions": JS_EXTENSIONS,
+                })
             elif "eslint" in deps:
-                result["linters"].append({"name": "eslint", "cmd": ["npx", "eslint", "."]})
-            
-            # Check for TypeScript
+                result["linters"].append({
+                    "name": "eslint",
+                    "cmd": ["npx", "eslint", "."],
+                    "changed_cmd": ["npx", "eslint"],
+                    "extensions": JS_EXTENSIONS,
+                })
+
+            # Check for TypeScript (whole-program: always checks the full project)
             if "typescript" in deps or (project_path / "tsconfig.json").exists():
-                result["linters"].append({"name": "tsc", "cmd": ["npx", "tsc", "--noEmit"]})
-                
+                result["linters"].append({
+                    "name": "tsc",
+                    "cmd": ["npx", "tsc", "--noEmit"],
+                    "extensions": (".ts", ".tsx"),
+                })
+
         except:
             pass
-    
+
     # Python project
     if (project_path / "pyproject.toml").exists() or (project_path / "requirements.txt").exists():
         result["type"] = "python"
-        
+
         # Check for ruff
-        result["linters"].append({"name": "ruff", "cmd": ["ruff", "check", "."]})
-        
+        result["linters"].append({
+            "name": "ruff",
+            "cmd": ["ruff", "check", "."],
+            "changed_cmd": ["ruff", "check"],
+            "extensions": PY_EXTENSIONS,
+        })
+
         # Check for mypy
         if (project_path / "mypy.ini").exists() or (project_path / "pyproject.toml").exists():
-            result["linters"].append({"name": "mypy", "cmd": ["mypy", "."]})
-    
+            result["linters"].append({
+                "name": "mypy",
+                "cmd": ["mypy", "."],
+                "changed_cmd": ["mypy"],
+                "extensions": PY_EXTENSIONS,
+            })
+
     return result
 
 
-def run_linter(linter: dict, cwd: Path) -> dict:
-    """Run a single linter and return results."""
+def git_lines(args: list, cwd: Path) -> list:
+    """Run a git command and return its non-empty output lines, or None outside a repo."""
+    try:
+        proc = subprocess.run(
+            ["git", *args], cwd=str(cwd), capture_output=True, text=True,
+            encoding='utf-8', errors='replace', timeout=60
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0:
+        return None
+    return [line for line in proc.stdout.splitlines() if line.strip()]
+
+
+def changed_files(project_path: Path) -> list:
+    """Files modified or deleted against HEAD plus untracked files, relative to project_path.
+
+    Deleted paths are kept: the index still lists them with their old blob
+    hash, so they must reach the fingerprint to change the cache key.
+    """
+    modified = git_lines(["diff", "--name-only", "--relative", "HEAD"], project_path)
+    untracked = git_lines(["ls-files", "--others", "--exclude-standard"], project_path)
+    if modified is None or untracked is None:
+        return None
+    paths = {path for path in modified + untracked if path != CACHE_FILE}
+    return sorted(path for path in paths if not (project_path / path).is_dir())
+
+
+def hash_file(path: Path, digest) -> None:
+    """Feed a file's path and content into digest (missing files hash as deleted)."""
+    digest.update(str(path).encode("utf-8", "replace") + b"\0")
+    try:
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        digest.update(b"<deleted>")
+
+
+def inputs_fingerprint(project_path: Path, extensions: tuple, files: list = None) -> str:
+    """Hash of the inputs a linter reads.
+
+    In a git repo the index already stores a content hash per tracked file, so
+    only modified/untracked files are read from disk. Outside git every
+    matching file is hashed by size and mtime.
+    """
+    digest = hashlib.sha256()
+    config_names = ("package.json", "tsconfig.json", "pyproject.toml", "mypy.ini",
+                    "ruff.toml", ".ruff.toml", "setup.cfg", "requirements.txt",
+                    ".eslintrc", ".eslintrc.json", ".eslintrc.js", ".eslintrc.cjs",
+                    "eslint.config.js", "eslint.config.mjs")
+    for name in config_names:
+        if (project_path / name).exists():
+            hash_file(project_path / name, digest)
+
+    if files is not None:
+        for rel in files:
+            hash_file(project_path / rel, digest)
+        return digest.hexdigest()
+
+    staged = git_lines(["ls-files", "-s"], project_path)
+    dirty = changed_files(project_path)
+    if staged is not None and dirty is not None:
+        for line in staged:
+            if line.endswith(extensions):
+                digest.update(line.encode("utf-8", "replace") + b"\n")
+        for rel in dirty:
+            if rel.endswith(extensions):
+                hash_file(project_path / rel, digest)
+        return digest.hexdigest()
+
+    for root, dirs, names in os.walk(project_path):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(names):
+            if name.endswith(extensions):
+                path = Path(root) / name
+                stat = path.stat()
+                digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8", "replace"))
+    return digest.hexdigest()
+
+
+def load_cache(project_path: Path) -> dict:
+    """Load cached results; a corrupt or old-format cache is ignored."""
+    try:
+        data = json.loads((project_path / CACHE_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data.get("entries", {})
+
+
+def save_cache(project_path: Path, entries: dict) -> None:
+    """Persist cached results atomically."""
+    path = project_path / CACHE_FILE
+    tmp = path.with_suffix(".tmp")
+    try:
+        tmp.write_text(json.dumps({"version": CACHE_VERSION, "entries": entries}), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def run_linter(linter: dict, cwd: Path, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    """Run a single linter, streaming its output, and return results."""
     result = {
         "name": linter["name"],
         "passed": False,
         "output": "",
-        "error": ""
+        "error": "",
+        "duration_s": 0.0,
+        "cached": False,
     }
-    
+    started = time.monotonic()
+
     try:
-        cmd = linter["cmd"]
-        
+        cmd = list(linter["cmd"])
+
         # Windows compatibility for npm/npx
         if platform.system() == "Windows":
             if cmd[0] in ["npm", "npx"]:
                 # Force .cmd extension on Windows
                 if not cmd[0].lower().endswith(".cmd"):
                     cmd[0] = f"{cmd[0]}.cmd"
-        
-        proc = subprocess.run(
+
+        proc = subprocess.Popen(
             cmd,
             cwd=str(cwd),
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,
             encoding='utf-8',
             errors='replace',
-            timeout=120,
             shell=platform.system() == "Windows" # Shell=True often helps with path resolution on Windows
         )
-        
-        result["output"] = proc.stdout[:2000] if proc.stdout else ""
-        result["error"] = proc.stderr[:500] if proc.stderr else ""
-        result["passed"] = proc.returncode == 0
-        
+
+        # stderr is drained on its own thread so neither pipe can fill up and block
+        stderr_lines = []
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_lines.extend(proc.stderr), daemon=True
+        )
+        stderr_thread.start()
+
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        stdout_lines = []
+        try:
+            for line in proc.stdout:
+                stdout_lines.append(line)
+                log(f"  [{linter['name']}] {line.rstrip()}")
+            proc.wait()
+        finally:
+            timed_out = not timer.is_alive()
+            timer.cancel()
+        stderr_thread.join()
+
+        result["output"] = "".join(stdout_lines)
+        result["error"] = "".join(stderr_lines)
+        if timed_out:
+            result["error"] = f"Timeout after {timeout}s"
+        else:
+            result["passed"] = proc.returncode == 0
+
     except FileNotFoundError:
         result["error"] = f"Command not found: {linter['cmd'][0]}"
-    except subprocess.TimeoutExpired:
-        result["error"] = "Timeout after 120s"
     except Exception as e:
         result["error"] = str(e)
-    
+
+    result["duration_s"] = round(time.monotonic() - started, 2)
+    return result
+
+
+def plan_changed(linter: dict, files: list, project_path: Path) -> dict:
+    """Restrict a linter to changed files; None when nothing it checks changed.
+
+    Linters without a per-file command, and deletions (which can break files
+    that import the deleted one), fall back to a full run.
+    """
+    relevant = [path for path in files if path.endswith(linter["extensions"])]
+    if not relevant:
+        return None
+    existing = [path for path in relevant if (project_path / path).is_file()]
+    if "changed_cmd" not in linter or len(existing) < len(relevant):
+        return {**linter, "files": None}
+    return {**linter, "cmd": [*linter["changed_cmd"], *existing], "files": existing}
+
+
+def lint_one(linter: dict, project_path: Path, cache: dict, use_cache: bool, timeout: int) -> dict:
+    """Return a cached result when the inputs are unchanged, otherwise run the linter."""
+    key = None
+    if use_cache:
+        fingerprint = inputs_fingerprint(project_path, linter["extensions"], linter.get("files"))
+        key = hashlib.sha256(f"{linter['cmd']}|{fingerprint}".encode("utf-8")).hexdigest()
+        cached = cache.get(key)
+        if cached:
+            log(f"  [CACHED] {linter['name']}")
+            return {**cached, "cached": True, "duration_s": 0.0}
+
+    log(f"\nRunning: {linter['name']}...")
+    result = run_linter(linter, project_path, timeout)
+    # Timeouts and missing tools are environmental, so they are never cached
+    if key and not result["error"].startswith(("Timeout", "Command not found")):
+        cache[key] = result
     return result
 
 
 def main():
-    project_path = Path(sys.argv[1] if len(sys.argv) > 1 else ".").resolve()
-    
+    parser = argparse.ArgumentParser(description="Unified lint runner")
+    parser.add_argument("project", nargs="?", default=".")
+    parser.add_argument("--changed", action="store_true", help="lint only files git reports as changed")
+    parser.add_argument("--jobs", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="per-linter timeout in seconds")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    project_path = Path(args.project).resolve()
+
     print(f"\n{'='*60}")
     print(f"[LINT RUNNER] Unified Linting")
     print(f"{'='*60}")
     print(f"Project: {project_path}")
     print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
+
     # Detect project type
     project_info = detect_project_type(project_path)
     print(f"Type: {project_info['type']}")
     print(f"Linters: {len(project_info['linters'])}")
     print("-"*60)
-    
+
     if not project_info["linters"]:
         print("No linters found for this project type.")
         output = {
@@ -140,45 +361,60 @@ def main():
         }
         print(json.dumps(output, indent=2))
         sys.exit(0)
-    
-    # Run each linter
-    results = []
-    all_passed = True
-    
-    for linter in project_info["linters"]:
-        print(f"\nRunning: {linter['name']}...")
-        result = run_linter(linter, project_path)
-        results.append(result)
-        
-        if result["passed"]:
-            print(f"  [PASS] {linter['name']}")
+
+    linters = project_info["linters"]
+    if args.changed:
+        files = changed_files(project_path)
+        if files is None:
+            print("Not a git repository; linting everything.")
         else:
-            print(f"  [FAIL] {linter['name']}")
-            if result["error"]:
-                print(f"  Error: {result['error'][:200]}")
-            all_passed = False
-    
+            print(f"Changed files: {len(files)}")
+            planned = [plan_changed(linter, files, project_path) for linter in linters]
+            linters = [linter for linter in planned if linter]
+            for linter in linters:
+                if linter["files"] is None:
+                    print(f"  {linter['name']}: full run (no per-file mode, or a file was deleted)")
+
+    # Run linters concurrently
+    cache = load_cache(project_path) if not args.no_cache else {}
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [
+            pool.submit(lint_one, linter, project_path, cache, not args.no_cache, args.timeout)
+            for linter in linters
+        ]
+        results = [future.result() for future in futures]
+    if not args.no_cache:
+        save_cache(project_path, cache)
+
+    all_passed = all(r["passed"] for r in results)
+
     # Summary
     print("\n" + "="*60)
     print("SUMMARY")
     print("="*60)
-    
+
     for r in results:
         icon = "[PASS]" if r["passed"] else "[FAIL]"
-        print(f"{icon} {r['name']}")
-    
+        suffix = " (cached)" if r["cached"] else ""
+        print(f"{icon} {r['name']}  {r['duration_s']:.2f}s{suffix}")
+        if not r["passed"] and r["error"]:
+            print(f"  Error: {r['error'][:200]}")
+    print(f"Wall time: {time.monotonic() - started:.2f}s")
+
     output = {
         "script": "lint_runner",
         "project": str(project_path),
         "type": project_info["type"],
+        "changed_only": args.changed,
         "checks": results,
         "passed": all_passed
     }
-    
+
     print("\n" + json.dumps(output, indent=2))
-    
+
     sys.exit(0 if all_passed else 1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
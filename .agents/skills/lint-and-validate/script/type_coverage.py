@@ -2,12 +2,25 @@
 """
 Type Coverage Checker - Measures TypeScript/Python type coverage.
 Identifies untyped functions, any usage, and type safety issues.
+
+Python files are analyzed with the ast module across a process pool. Results
+are cached per file in .type_coverage_cache.json keyed by content hash, so
+repeat runs only re-parse files that changed.
 """
+import ast
+import hashlib
+import json
+import os
 import sys
 import re
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+IGNORED_DIRS = {'venv', '.venv', 'env', '__pycache__', '.git', 'node_modules', '.mypy_cache', '.ruff_cache', '.tox', 'dist', 'build'}
+CACHE_FILE = '.type_coverage_cache.json'
+CACHE_VERSION = 1
+
 # Fix Windows console encoding for Unicode output
 try:
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -15,14 +28,25 @@ try:
 except AttributeError:
     pass  # Python < 3.7
 
+def iter_source_files(project_path: Path, suffixes: tuple) -> list:
+    """Walk the tree, pruning ignored directories before descending into them."""
+    found = []
+    for root, dirs, files in os.walk(project_path):
+        dirs[:] = [d for d in dirs if d not in IGNORED_DIRS and not d.endswith('.egg-info')]
+        for name in files:
+            if name.endswith(suffixes):
+                found.append(Path(root) / name)
+    found.sort()
+    return found
+
+
 def check_typescript_coverage(project_path: Path) -> dict:
     """Check TypeScript type coverage."""
     issues = []
     passed = []
     stats = {'any_count': 0, 'untyped_functions': 0, 'total_functions': 0}
     
-    ts_files = list(project_path.rglob("*.ts")) + list(project_path.rglob("*.tsx"))
-    ts_files = [f for f in ts_files if 'node_modules' not in str(f) and '.d.ts' not in str(f)]
+    ts_files = [f for f in iter_source_files(project_path, ('.ts', '.tsx')) if not f.name.endswith('.d.ts')]
     
     if not ts_files:
         return {'type': 'typescript', 'files': 0, 'passed': [], 'issues': ["[!] No TypeScript files found"], 'stats': stats}
@@ -71,40 +95,124 @@ def check_typescript_coverage(project_path: Path) -> dict:
     
     return {'type': 'typescript', 'files': len(ts_files), 'passed': passed, 'issues': issues, 'stats': stats}
 
-def check_python_coverage(project_path: Path) -> dict:
+def _is_any(node: ast.AST) -> bool:
+    return (isinstance(node, ast.Name) and node.id == 'Any') or (isinstance(node, ast.Attribute) and node.attr == 'Any')
+
+
+def analyze_python_source(source: str) -> dict:
+    """Count typed/untyped functions and Any annotations in one module.
+
+    A function is typed when it has a return annotation or at least one
+    annotated parameter (self/cls excluded).
+    """
+    stats = {'typed_functions': 0, 'untyped_functions': 0, 'any_count': 0, 'error': None}
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError) as exc:
+        stats['error'] = f"{type(exc).__name__}: {exc}"
+        return stats
+
+    annotations = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            args = node.args
+            params = args.posonlyargs + args.args + args.kwonlyargs
+            if params and params[0].arg in ('self', 'cls'):
+                params = params[1:]
+            params += [a for a in (args.vararg, args.kwarg) if a is not None]
+            param_annotations = [p.annotation for p in params if p.annotation is not None]
+            if node.returns is not None or param_annotations:
+                stats['typed_functions'] += 1
+            else:
+                stats['untyped_functions'] += 1
+            annotations.extend(param_annotations)
+            if node.returns is not None:
+                annotations.append(node.returns)
+        elif isinstance(node, ast.AnnAssign):
+            annotations.append(node.annotation)
+
+    for annotation in annotations:
+        stats['any_count'] += sum(1 for sub in ast.walk(annotation) if _is_any(sub))
+    return stats
+
+
+def analyze_python_file(path: str) -> tuple:
+    """Process-pool worker: parse one file and return (path, stats)."""
+    try:
+        source = Path(path).read_text(encoding='utf-8', errors='ignore')
+    except OSError as exc:
+        return path, {'typed_functions': 0, 'untyped_functions': 0, 'any_count': 0, 'error': str(exc)}
+    return path, analyze_python_source(source)
+
+
+def load_cache(project_path: Path) -> dict:
+    try:
+        data = json.loads((project_path / CACHE_FILE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    return data.get('files', {}) if data.get('version') == CACHE_VERSION else {}
+
+
+def save_cache(project_path: Path, entries: dict) -> None:
+    path = project_path / CACHE_FILE
+    tmp = path.with_suffix('.tmp')
+    try:
+        tmp.write_text(json.dumps({'version': CACHE_VERSION, 'files': entries}), encoding='utf-8')
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def check_python_coverage(project_path: Path, workers: int = None) -> dict:
     """Check Python type hints coverage."""
     issues = []
     passed = []
-    stats = {'untyped_functions': 0, 'typed_functions': 0, 'any_count': 0}
-    
-    py_files = list(project_path.rglob("*.py"))
-    py_files = [f for f in py_files if not any(x in str(f) for x in ['venv', '__pycache__', '.git', 'node_modules'])]
-    
+    stats = {'untyped_functions': 0, 'typed_functions': 0, 'any_count': 0, 'parse_errors': 0, 'cached_files': 0}
+
+    py_files = iter_source_files(project_path, ('.py',))
+
     if not py_files:
         return {'type': 'python', 'files': 0, 'passed': [], 'issues': ["[!] No Python files found"], 'stats': stats}
-    
-    for file_path in py_files[:30]:  # Limit
+
+    # Only files whose content hash is not in the cache are parsed again
+    cache = load_cache(project_path)
+    fresh_cache = {}
+    per_file = {}
+    pending = []
+    digests = {}
+    for file_path in py_files:
         try:
-            content = file_path.read_text(encoding='utf-8', errors='ignore')
-            
-            # Count Any usage
-            any_matches = re.findall(r':\s*Any\b', content)
-            stats['any_count'] += len(any_matches)
-            
-            # Find functions with type hints
-            typed_funcs = re.findall(r'def\s+\w+\s*\([^)]*:[^)]+\)', content)
-            typed_funcs += re.findall(r'def\s+\w+\s*\([^)]*\)\s*->', content)
-            stats['typed_functions'] += len(typed_funcs)
-            
-            # Find functions without type hints
-            all_funcs = re.findall(r'def\s+\w+\s*\(', content)
-            stats['untyped_functions'] += len(all_funcs) - len(typed_funcs)
-            
-        except Exception:
+            digest = hashlib.sha256(file_path.read_bytes()).hexdigest()
+        except OSError:
             continue
-    
+        digests[str(file_path)] = digest
+        if digest in cache:
+            per_file[str(file_path)] = cache[digest]
+            fresh_cache[digest] = cache[digest]
+            stats['cached_files'] += 1
+        else:
+            pending.append(str(file_path))
+
+    if len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(analyze_python_file, pending, chunksize=32))
+    else:
+        results = [analyze_python_file(path) for path in pending]
+    for path, file_stats in results:
+        per_file[path] = file_stats
+        fresh_cache[digests[path]] = file_stats
+    save_cache(project_path, fresh_cache)
+
+    for path, file_stats in per_file.items():
+        stats['typed_functions'] += file_stats['typed_functions']
+        stats['untyped_functions'] += file_stats['untyped_functions']
+        stats['any_count'] += file_stats['any_count']
+        if file_stats.get('error'):
+            stats['parse_errors'] += 1
+            issues.append(f"[!] Could not parse {Path(path).relative_to(project_path)}: {file_stats['error']}")
+
     total = stats['typed_functions'] + stats['untyped_functions']
-    
+
     if total > 0:
         typed_ratio = stats['typed_functions'] / total * 100
         if typed_ratio >= 70:
@@ -113,16 +221,16 @@ def check_python_coverage(project_path: Path) -> dict:
             issues.append(f"[!] Type hints coverage: {typed_ratio:.0f}%")
         else:
             issues.append(f"[X] Type hints coverage: {typed_ratio:.0f}% (add type hints)")
-    
+
     if stats['any_count'] == 0:
         passed.append("[OK] No 'Any' types found")
     elif stats['any_count'] <= 3:
         issues.append(f"[!] {stats['any_count']} 'Any' types found")
     else:
         issues.append(f"[X] {stats['any_count']} 'Any' types found")
-    
-    passed.append(f"[OK] Analyzed {len(py_files)} Python files")
-    
+
+    passed.append(f"[OK] Analyzed {len(py_files)} Python files ({stats['cached_files']} from cache, {total} functions)")
+
     return {'type': 'python', 'files': len(py_files), 'passed': passed, 'issues': issues, 'stats': stats}
 
 def main():
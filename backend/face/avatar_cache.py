@@ -0,0 +1,292 @@
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = "Mozilla/5.0 FaceTrainer/1.0"
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / ".avatar_cache"
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_FRESH_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_TIMEOUT = 15
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_REDIRECTS = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+INDEX_SAVE_EVERY = 50
+ORPHAN_GRACE_SECONDS = 300
+
+
+class FetchError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections per host with a per-host concurrency cap."""
+
+    def __init__(self, max_per_host: int = DEFAULT_MAX_PER_HOST, timeout: float = DEFAULT_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _release(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def request(self, url: str, headers: dict):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        with self._slot(key):
+            connection = self._acquire(key)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+        return response.status, {name.lower(): value for name, value in response.getheaders()}, body
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+class AvatarCache:
+    """Content-addressed avatar store with conditional GETs and size-based LRU eviction.
+
+    Blobs live under ``objects/<sha256[:2]>/<sha256>``; ``index.json`` maps each
+    URL to its blob plus the validators (ETag / Last-Modified) used to revalidate.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        fresh_seconds: float = DEFAULT_FRESH_SECONDS,
+        pool: ConnectionPool = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.index_path = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.pool = pool or ConnectionPool()
+        self.stats = {"hits": 0, "revalidated": 0, "downloaded": 0, "retries": 0, "evicted": 0, "orphans_removed": 0}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._index = self._load_index()
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return {}
+        try:
+            with self.index_path.open("r", encoding="utf-8") as file:
+                data = json.load(file)
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _blob_path(self, digest: str):
+        return self.objects_dir / digest[:2] / digest
+
+    def _read_blob(self, entry):
+        if not entry:
+            return None
+        path = self._blob_path(entry.get("sha256", ""))
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def _write_blob(self, content: bytes):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".tmp{threading.get_ident()}")
+            temp_path.write_bytes(content)
+            os.replace(temp_path, path)
+        return digest
+
+    def _get_with_retries(self, url: str, headers: dict):
+        for redirect in range(MAX_REDIRECTS + 1):
+            last_error = None
+            for attempt in range(MAX_RETRIES):
+                if attempt:
+                    with self._lock:
+                        self.stats["retries"] += 1
+                    time.sleep(RETRY_BACKOFF * (2 ** (attempt - 1)))
+                try:
+                    status, response_headers, body = self.pool.request(url, headers)
+                except (OSError, http.client.HTTPException) as exc:
+                    last_error = exc
+                    continue
+                if status in RETRY_STATUSES:
+                    last_error = FetchError(f"HTTP {status}")
+                    continue
+                break
+            else:
+                raise FetchError(f"Failed to fetch {url}: {last_error}")
+
+            if status in (301, 302, 303, 307, 308) and response_headers.get("location"):
+                url = urljoin(url, response_headers["location"])
+                continue
+            return status, response_headers, body
+        raise FetchError(f"Too many redirects for {url}")
+
+    def fetch(self, url: str) -> bytes:
+        with self._lock:
+            entry = dict(self._index.get(url) or {})
+
+        cached = self._read_blob(entry)
+        if cached is not None and time.time() - entry.get("fetched_at", 0) < self.fresh_seconds:
+            self._touch(url)
+            with self._lock:
+                self.stats["hits"] += 1
+            return cached
+
+        headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+        if cached is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        status, response_headers, body = self._get_with_retries(url, headers)
+        if status == 304 and cached is not None:
+            self._touch(url, fetched=True)
+            with self._lock:
+                self.stats["revalidated"] += 1
+            return cached
+        if status != 200:
+            raise FetchError(f"HTTP {status} for {url}")
+
+        digest = self._write_blob(body)
+        now = time.time()
+        with self._lock:
+            self._index[url] = {
+                "sha256": digest,
+                "size": len(body),
+                "etag": response_headers.get("etag", ""),
+                "last_modified": response_headers.get("last-modified", ""),
+                "fetched_at": now,
+                "last_used": now,
+            }
+            self.stats["downloaded"] += 1
+            self._unsaved += 1
+            flush = self._unsaved >= INDEX_SAVE_EVERY
+        # A crash mid-run would otherwise leave every blob downloaded so far
+        # unreferenced by index.json.
+        if flush:
+            self._write_index()
+        return body
+
+    def _touch(self, url: str, fetched: bool = False):
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return
+            entry["last_used"] = now
+            if fetched:
+                entry["fetched_at"] = now
+
+    def evict(self):
+        # Blobs are shared between URLs with identical content, so sizes are
+        # summed per digest and a blob is used as recently as its newest URL.
+        with self._lock:
+            blobs = {}
+            for url, entry in self._index.items():
+                blob = blobs.setdefault(entry["sha256"], {"size": entry.get("size", 0), "last_used": 0, "urls": []})
+                blob["last_used"] = max(blob["last_used"], entry.get("last_used", 0))
+                blob["urls"].append(url)
+
+            total = sum(blob["size"] for blob in blobs.values())
+            for digest, blob in sorted(blobs.items(), key=lambda pair: pair[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    self._blob_path(digest).unlink()
+                except OSError:
+                    pass
+                for url in blob["urls"]:
+                    self._index.pop(url, None)
+                total -= blob["size"]
+                self.stats["evicted"] += 1
+            referenced = {entry["sha256"] for entry in self._index.values()}
+
+        self._remove_orphans(referenced)
+
+    def _remove_orphans(self, referenced: set):
+        # Blobs written by a run that died before saving its index, and temp
+        # files from interrupted writes, are not counted above; drop them.
+        # Recent files are skipped in case a fetch is still recording them.
+        if not self.objects_dir.is_dir():
+            return
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        for path in self.objects_dir.glob("*/*"):
+            if path.name in referenced:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    self.stats["orphans_removed"] += 1
+            except OSError:
+                pass
+
+    def _write_index(self):
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self._index, ensure_ascii=False)
+                self._unsaved = 0
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = self.index_path.with_suffix(".tmp")
+            temp_path.write_text(data, encoding="utf-8")
+            os.replace(temp_path, self.index_path)
+
+    def save(self):
+        self.evict()
+        self._write_index()
+
+    def close(self):
+        try:
+            self.save()
+        finally:
+            self.pool.close()
@@ -0,0 +1,187 @@
+import argparse
+import base64
+import http.client
+import json
+import struct
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from face_engine import STREAM_DETECT_SCALE, detect_stage, emit_event, open_frame_source, read_frames
+
+# Runs on the kiosk PC: detection and encoding happen here with the same
+# face_engine pipeline the server uses, and only the 128-d embedding (512 bytes
+# as float32) plus its box is sent to /api/face/verify/embedding.
+
+EMBEDDING_DIM = 128
+VERIFY_PATH = "/api/face/verify/embedding"
+DEFAULT_INTERVAL = 2.0
+DEFAULT_TIMEOUT = 10.0
+
+
+def pack_embedding(encoding):
+    return struct.pack(f"<{EMBEDDING_DIM}f", *(float(value) for value in encoding))
+
+
+def largest_box(boxes):
+    # The kiosk serves one person at a time: the biggest face is the one at the gate.
+    return max(boxes, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+
+
+class EdgeClient:
+    """Keep-alive client for the compact, embedding-only verify endpoint."""
+
+    def __init__(self, server_url: str, use_base64: bool = False, timeout: float = DEFAULT_TIMEOUT):
+        self.url = urlsplit(server_url.rstrip("/"))
+        self.use_base64 = use_base64
+        self.timeout = timeout
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            port = self.url.port or (443 if self.url.scheme == "https" else 80)
+            if self.url.scheme == "https":
+                self._connection = http.client.HTTPSConnection(self.url.hostname, port, timeout=self.timeout)
+            else:
+                self._connection = http.client.HTTPConnection(self.url.hostname, port, timeout=self.timeout)
+        return self._connection
+
+    def verify(self, encoding, box=None, date: str = ""):
+        payload = pack_embedding(encoding)
+        path = self.url.path + VERIFY_PATH
+        if self.use_base64:
+            document = {"embedding": base64.b64encode(payload).decode("ascii")}
+            if box is not None:
+                document["box"] = list(box)
+            if date:
+                document["date"] = date
+            body = json.dumps(document).encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+        else:
+            body = payload
+            headers = {"Content-Type": "application/octet-stream"}
+            if box is not None:
+                headers["X-Face-Box"] = ",".join(str(int(value)) for value in box)
+            if date:
+                path = f"{path}?date={date}"
+
+        for attempt in range(2):
+            connection = self._connect()
+            try:
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                raw = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # One retry covers a keep-alive socket the server already closed.
+                if attempt:
+                    raise
+        try:
+            result = json.loads(raw)
+        except ValueError:
+            result = {"status": "fail", "message": f"HTTP {response.status}"}
+        return result, len(body)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def image_frames(image_path: Path):
+    import face_recognition
+
+    # detect_stage expects BGR frames like OpenCV delivers them.
+    image = face_recognition.load_image_file(str(image_path))
+    yield 0, time.time(), image[:, :, ::-1]
+
+
+def run(client: EdgeClient, frames, scale: float, interval: float, date: str):
+    import face_recognition
+
+    last_sent = 0.0
+
+    def due(source_frames):
+        # Frames arriving inside the interval are dropped before detection, and
+        # only the largest face is encoded, so the CPU work tracks the verify
+        # rate rather than the camera frame rate.
+        for item in source_frames:
+            if time.monotonic() - last_sent >= interval:
+                yield item
+
+    for index, timestamp, rgb, boxes in detect_stage(due(frames), scale):
+        if not boxes:
+            continue
+        box = largest_box(boxes)
+        encodings = face_recognition.face_encodings(rgb, [box])
+        if not encodings:
+            continue
+        last_sent = time.monotonic()
+        started = time.perf_counter()
+        try:
+            result, payload_bytes = client.verify(encodings[0], box, date)
+        except (OSError, http.client.HTTPException) as exc:
+            emit_event({"event": "error", "frame": index, "message": str(exc)})
+            continue
+        emit_event(
+            {
+                "event": "recognition",
+                "frame": index,
+                "timestamp": round(timestamp, 3),
+                "box": list(box),
+                "payload_bytes": payload_bytes,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                **result,
+            }
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="edge_client.py", description="Encode faces on the kiosk, match on the server")
+    parser.add_argument("--server", required=True, help="server base URL, e.g. http://10.0.0.5:5000")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source", help="camera index, video file or MJPEG/HTTP stream URL")
+    source.add_argument("--image", help="encode and verify a single image")
+    parser.add_argument("--scale", type=float, default=STREAM_DETECT_SCALE)
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="min seconds between verify calls")
+    parser.add_argument("--base64", action="store_true", help="send JSON with a base64 embedding instead of binary")
+    parser.add_argument("--date", default="", help="attendance date (YYYY-MM-DD), default today on the server")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    client = EdgeClient(args.server, use_base64=args.base64, timeout=args.timeout)
+
+    if args.image:
+        image_path = Path(args.image).resolve()
+        if not image_path.exists():
+            emit_event({"event": "error", "message": "Image file not found"})
+            return
+        run(client, image_frames(image_path), 1.0, 0.0, args.date)
+        client.close()
+        return
+
+    capture = open_frame_source(args.source)
+    if capture is None:
+        emit_event({"event": "error", "message": "Unable to open frame source"})
+        return
+    stats = {"read": 0, "dropped": 0}
+    emit_event({"event": "start", "source": args.source, "server": args.server})
+    frames = read_frames(capture, stats)
+    try:
+        run(client, frames, args.scale, args.interval, args.date)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+        capture.release()
+        client.close()
+    emit_event({"event": "end", **stats})
+
+
+if __name__ == "__main__":
+    main()
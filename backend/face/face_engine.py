@@ -1,79 +1,512 @@
+import argparse
 import json
+import os
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
 
-import face_recognition
-import numpy as np
+# face_recognition (dlib + model loading) and numpy are imported lazily inside
+# the functions that need them, so argument/gallery validation failures return
+# without paying the heavy import cost.
 
-MATCH_THRESHOLD = 0.50
+# server.js exports FACE_MATCH_THRESHOLD to the processes it spawns, so its
+# in-process embedding matcher and this engine always use the same cutoff.
+MATCH_THRESHOLD = float(os.environ.get("FACE_MATCH_THRESHOLD", "0.50"))
+STREAM_DETECT_SCALE = 0.5
+PROFILED_IMPORTS = ("numpy", "PIL.Image", "cv2", "dlib", "face_recognition_models", "face_recognition")
+PREWARM_CHUNK_SIZE = 1024 * 1024
+PROFILE_KEEP = 50
+PROFILE_TOP_FUNCTIONS = 40
 
 
 def fail(message: str):
     print(json.dumps({"status": "fail", "message": message}, ensure_ascii=True))
 
 
-def main():
-    if len(sys.argv) < 2:
-        fail("Image path is required")
-        return
+def emit_event(event: dict):
+    sys.stdout.write(json.dumps(event, ensure_ascii=True) + "\n")
+    sys.stdout.flush()
 
-    image_path = Path(sys.argv[1]).resolve()
-    if not image_path.exists():
-        fail("Image file not found")
-        return
 
-    current_file = Path(__file__).resolve()
-    encodings_path = current_file.parent / "face_encodings.json"
-    if not encodings_path.exists():
-        fail("face_encodings.json not found")
-        return
+def default_encodings_path():
+    return Path(__file__).resolve().parent / "face_encodings.json"
 
+
+def load_gallery_items(encodings_path: Path):
     with encodings_path.open("r", encoding="utf-8") as file:
         known_faces = json.load(file)
+    return [item for item in known_faces or [] if item.get("encoding")]
 
-    if not known_faces:
-        fail("No match found")
-        return
 
-    image = face_recognition.load_image_file(str(image_path))
-    input_encodings = face_recognition.face_encodings(image)
-    if not input_encodings:
-        fail("No match found")
-        return
+def iter_gallery_items(encodings_path: Path):
+    # train_faces.py writes one record per line inside the array, so the file
+    # can be streamed record by record; older indent=2 files fall back to
+    # json.load before anything has been yielded.
+    with encodings_path.open("r", encoding="utf-8") as file:
+        if file.readline().strip() == "[":
+            yielded = False
+            for line in file:
+                text = line.strip().rstrip(",")
+                if text in ("", "]"):
+                    continue
+                try:
+                    item = json.loads(text)
+                except ValueError:
+                    if yielded:
+                        raise
+                    break
+                yielded = True
+                if isinstance(item, dict) and item.get("encoding"):
+                    yield item
+            else:
+                return
+    yield from load_gallery_items(encodings_path)
+
+
+def build_gallery(items):
+    import numpy as np
+
+    if not items:
+        return items, np.empty((0, 128), dtype=float)
+    return items, np.array([item["encoding"] for item in items], dtype=float)
+
+
+def attach_gallery_store():
+    # FACE_GALLERY_STORE points at a store published by gallery_store.py; the
+    # embedding matrix is then mapped zero-copy instead of parsed from JSON.
+    if not os.environ.get("FACE_GALLERY_STORE"):
+        return None
+    from gallery_store import GalleryStore, store_dir_from_env
+
+    store = GalleryStore(store_dir_from_env())
+    if store.gallery() is None:
+        return None
+    return store
+
+
+def match_encoding(gallery, input_encoding):
+    import face_recognition
+    import numpy as np
+
+    items, matrix = gallery
+    if not items:
+        return None, None
+
+    distances = face_recognition.face_distance(matrix, input_encoding)
+    best_index = int(np.argmin(distances))
+    best_distance = float(distances[best_index])
+    if best_distance >= MATCH_THRESHOLD:
+        return None, best_distance
+    return items[best_index], best_distance
+
+
+def build_match_result(item, distance: float):
+    return {
+        "status": "success",
+        "student_code": item.get("student_code", ""),
+        "full_name": item.get("full_name", ""),
+        "class_name": item.get("class_name", ""),
+        "confidence": round(max(0.0, 1.0 - distance), 2),
+    }
+
+
+def open_frame_source(source: str):
+    import cv2
+
+    # A bare integer selects a local camera device (0 = /dev/video0);
+    # anything else is handed to OpenCV as a file path or stream URL.
+    target = int(source) if source.isdigit() else source
+    capture = cv2.VideoCapture(target)
+    if not capture.isOpened():
+        return None
+    return capture
 
-    input_encoding = input_encodings[0]
 
-    best_item = None
-    best_distance = None
+def read_frames(capture, stats: dict, drop_when_behind: bool = True):
+    # Frames are read on a background thread into a single-slot buffer.
+    # When the pipeline is slower than the source, the stale frame is
+    # replaced by the newest one so recognitions stay close to real time.
+    # Closing the generator stops and joins the reader, so the caller can
+    # release the capture only once nothing is inside capture.read().
+    buffer = queue.Queue(maxsize=1)
+    stop = threading.Event()
 
-    for item in known_faces:
-        known_vector = np.array(item.get("encoding", []), dtype=float)
-        if known_vector.size == 0:
-            continue
+    def put_blocking(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
 
-        distance = face_recognition.face_distance([known_vector], input_encoding)[0]
-        if best_distance is None or distance < best_distance:
-            best_distance = float(distance)
-            best_item = item
+    def produce():
+        index = 0
+        while not stop.is_set():
+            ok, frame = capture.read()
+            if not ok:
+                break
+            item = (index, time.time(), frame)
+            index += 1
+            stats["read"] = index
+            if not drop_when_behind:
+                put_blocking(item)
+                continue
+            while True:
+                try:
+                    buffer.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        buffer.get_nowait()
+                        stats["dropped"] += 1
+                    except queue.Empty:
+                        pass
+        put_blocking(None)
 
-    if best_item is None or best_distance is None or best_distance >= MATCH_THRESHOLD:
-        fail("No match found")
+    reader = threading.Thread(target=produce, daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is None:
+                return
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+def detect_stage(frames, scale: float = STREAM_DETECT_SCALE):
+    import cv2
+    import face_recognition
+    import numpy as np
+
+    for index, timestamp, frame in frames:
+        rgb = np.ascontiguousarray(frame[:, :, ::-1])
+        if scale != 1.0:
+            small = cv2.resize(rgb, (0, 0), fx=scale, fy=scale)
+            locations = face_recognition.face_locations(small)
+            boxes = [tuple(int(round(value / scale)) for value in loc) for loc in locations]
+        else:
+            boxes = face_recognition.face_locations(rgb)
+        yield index, timestamp, rgb, boxes
+
+
+def encode_stage(detections):
+    import face_recognition
+
+    for index, timestamp, rgb, boxes in detections:
+        encodings = face_recognition.face_encodings(rgb, boxes) if boxes else []
+        yield index, timestamp, boxes, encodings
+
+
+def match_stage(encoded, get_gallery):
+    for index, timestamp, boxes, encodings in encoded:
+        gallery = get_gallery()
+        for box, encoding in zip(boxes, encodings):
+            item, distance = match_encoding(gallery, encoding)
+            if item is None:
+                result = {"status": "fail", "message": "No match found"}
+            else:
+                result = build_match_result(item, distance)
+            yield {
+                "event": "recognition",
+                "frame": index,
+                "timestamp": round(timestamp, 3),
+                "box": list(box),
+                **result,
+            }
+
+
+def run_stream(argv):
+    parser = argparse.ArgumentParser(prog="face_engine.py --stream")
+    parser.add_argument("source", help="camera index, video file or MJPEG/HTTP stream URL")
+    parser.add_argument("--encodings", default=str(default_encodings_path()))
+    parser.add_argument("--scale", type=float, default=STREAM_DETECT_SCALE)
+    parser.add_argument("--max-frames", type=int, default=0)
+    parser.add_argument("--no-drop", action="store_true", help="process every frame (video files)")
+    args = parser.parse_args(argv)
+
+    # A long-running stream follows newly published store generations.
+    store = attach_gallery_store()
+    if store is not None:
+        get_gallery = store.gallery
+    else:
+        encodings_path = Path(args.encodings).resolve()
+        if not encodings_path.exists():
+            emit_event({"event": "error", "message": "face_encodings.json not found"})
+            return
+        gallery = build_gallery(load_gallery_items(encodings_path))
+
+        def get_gallery():
+            return gallery
+
+    capture = open_frame_source(args.source)
+    if capture is None:
+        emit_event({"event": "error", "message": "Unable to open frame source"})
         return
 
-    confidence = round(max(0.0, 1.0 - best_distance), 2)
+    stats = {"read": 0, "dropped": 0, "processed": 0}
+    emit_event({"event": "start", "source": args.source, "gallery_size": len(get_gallery()[0])})
+
+    frames = read_frames(capture, stats, drop_when_behind=not args.no_drop)
+
+    def counted(source_frames):
+        for item in source_frames:
+            stats["processed"] += 1
+            yield item
+            if args.max_frames and stats["processed"] >= args.max_frames:
+                return
+
+    pipeline = match_stage(encode_stage(detect_stage(counted(frames), args.scale)), get_gallery)
+    try:
+        for event in pipeline:
+            emit_event(event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+        capture.release()
+
+    emit_event({"event": "end", **stats})
+
+
+def profile_imports():
+    # Each module is timed in dependency order, so a row reports only the
+    # cost that module adds on top of the ones already imported above it.
+    import importlib
+
+    modules = []
+    started = time.perf_counter()
+    for name in PROFILED_IMPORTS:
+        before = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            error = None
+        except Exception as exc:
+            error = str(exc)
+        modules.append(
+            {
+                "module": name,
+                "ms": round((time.perf_counter() - before) * 1000, 1),
+                "error": error,
+            }
+        )
+    print(
+        json.dumps(
+            {
+                "status": "success",
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                "modules": modules,
+            },
+            ensure_ascii=True,
+        )
+    )
+
+
+def read_into_page_cache(path: Path):
+    size = 0
+    with path.open("rb") as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while True:
+            chunk = file.read(PREWARM_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+    return size
+
+
+def prewarm():
+    started = time.perf_counter()
+    import dlib
+    import face_recognition
+    import face_recognition_models
+
+    files = [
+        Path(dlib.__file__),
+        Path(face_recognition_models.pose_predictor_model_location()),
+        Path(face_recognition_models.pose_predictor_five_point_model_location()),
+        Path(face_recognition_models.face_recognition_model_location()),
+        default_encodings_path(),
+    ]
+    cached_bytes = 0
+    for path in files:
+        if path.exists():
+            cached_bytes += read_into_page_cache(path)
+
+    gallery_size = 0
+    if default_encodings_path().exists():
+        gallery_size = len(build_gallery(load_gallery_items(default_encodings_path()))[0])
+
+    # Run one tiny detection so dlib's lazily initialised detector is built too.
+    import numpy as np
+
+    face_recognition.face_locations(np.zeros((32, 32, 3), dtype=np.uint8))
     print(
         json.dumps(
             {
                 "status": "success",
-                "student_code": best_item.get("student_code", ""),
-                "full_name": best_item.get("full_name", ""),
-                "class_name": best_item.get("class_name", ""),
-                "confidence": confidence
+                "message": "Prewarm completed",
+                "cached_bytes": cached_bytes,
+                "gallery_size": gallery_size,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
             },
-            ensure_ascii=True
+            ensure_ascii=True,
         )
     )
 
 
+def fail_result(message: str):
+    return {"status": "fail", "message": message}
+
+
+def parse_box(value: str):
+    # "top,right,bottom,left" in pixels, the face_recognition location order.
+    try:
+        top, right, bottom, left = (int(round(float(part))) for part in value.split(","))
+    except ValueError:
+        return None
+    if top < 0 or left < 0 or bottom <= top or right <= left:
+        return None
+    return top, right, bottom, left
+
+
+def encode_probe(image_path: Path, box=None):
+    import face_recognition
+
+    image = face_recognition.load_image_file(str(image_path))
+    if box is None:
+        return face_recognition.face_encodings(image)
+    # A box from an earlier /detect call skips the HOG detector entirely; only
+    # the landmark predictor and the encoder run on the known crop.
+    return face_recognition.face_encodings(image, known_face_locations=[box])
+
+
+def match_image_sharded(image_path: Path, manifest_path: Path, box=None):
+    if not manifest_path.exists():
+        return fail_result("Shard manifest not found")
+
+    from face_shards import load_manifest, sharded_result
+
+    input_encodings = encode_probe(image_path, box)
+    if not input_encodings:
+        return fail_result("No match found")
+    return sharded_result(load_manifest(manifest_path), input_encodings[0])
+
+
+def recognize_image(image_path: Path, box=None):
+    # With FACE_SHARD_MANIFEST set, the probe is scattered to the shard
+    # matcher processes instead of scanning the local gallery.
+    shard_manifest = os.environ.get("FACE_SHARD_MANIFEST", "")
+    if shard_manifest:
+        return match_image_sharded(image_path, Path(shard_manifest).resolve(), box)
+
+    store = attach_gallery_store()
+    if store is not None:
+        gallery = store.gallery()
+    else:
+        encodings_path = default_encodings_path()
+        if not encodings_path.exists():
+            return fail_result("face_encodings.json not found")
+        gallery = load_gallery_items(encodings_path), None
+
+    if not gallery[0]:
+        return fail_result("No match found")
+
+    if gallery[1] is None:
+        gallery = build_gallery(gallery[0])
+    input_encodings = encode_probe(image_path, box)
+    if not input_encodings:
+        return fail_result("No match found")
+
+    best_item, best_distance = match_encoding(gallery, input_encodings[0])
+    if best_item is None:
+        return fail_result("No match found")
+    return build_match_result(best_item, best_distance)
+
+
+def profile_dir():
+    return Path(os.environ.get("FACE_PROFILE_DIR") or Path(__file__).resolve().parent / "profiles")
+
+
+def prune_profiles(directory: Path, keep: int):
+    profiles = sorted(directory.glob("*.pstats"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale in profiles[keep:]:
+        for path in (stale, stale.with_suffix(".txt")):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def run_profiled(func, *args):
+    # cProfile covers the whole request, heavy imports included, so a cold
+    # start shows up in the profile exactly as the kiosk experienced it.
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    result = profiler.runcall(func, *args)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.urandom(3).hex()}"
+    profiler.dump_stats(str(directory / f"{profile_id}.pstats"))
+
+    summary = io.StringIO()
+    summary.write(f"profile_id: {profile_id}\nelapsed_ms: {elapsed_ms}\nstatus: {result.get('status')}\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    (directory / f"{profile_id}.txt").write_text(summary.getvalue(), encoding="utf-8")
+
+    prune_profiles(directory, int(os.environ.get("FACE_PROFILE_KEEP", PROFILE_KEEP)))
+    return {**result, "profile_id": profile_id, "elapsed_ms": elapsed_ms}
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "--stream":
+        run_stream(sys.argv[2:])
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == "--profile-imports":
+        profile_imports()
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == "--prewarm":
+        prewarm()
+        return
+
+    args = [arg for arg in sys.argv[1:] if arg != "--profile"]
+    profile = "--profile" in sys.argv[1:] or os.environ.get("FACE_PROFILE") == "1"
+
+    box = None
+    if "--box" in args:
+        index = args.index("--box")
+        box = parse_box(args[index + 1]) if index + 1 < len(args) else None
+        if box is None:
+            fail("Invalid face box, expected top,right,bottom,left")
+            return
+        del args[index:index + 2]
+
+    if not args:
+        fail("Image path is required")
+        return
+
+    image_path = Path(args[0]).resolve()
+    if not image_path.exists():
+        fail("Image file not found")
+        return
+
+    if profile:
+        result = run_profiled(recognize_image, image_path, box)
+    else:
+        result = recognize_image(image_path, box)
+    print(json.dumps(result, ensure_ascii=True))
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,308 @@
+import argparse
+import heapq
+import json
+import os
+import re
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from face_engine import MATCH_THRESHOLD, build_gallery, build_match_result, default_encodings_path, load_gallery_items
+
+DEFAULT_BASE_PORT = 7601
+DEFAULT_TOP_K = 3
+SHARD_TIMEOUT = 2.0
+MANIFEST_NAME = "shards.json"
+
+
+def shard_key(item: dict, by: str, shard_count: int):
+    # "hash" spreads students evenly; any other value names a record field
+    # (class_name, class_id, ...) so each value maps to one shard.
+    if by == "hash":
+        code = str(item.get("student_code", ""))
+        return f"shard_{zlib.crc32(code.encode('utf-8')) % shard_count}"
+    value = str(item.get(by) or "").strip() or "unassigned"
+    return "shard_" + re.sub(r"[^\w.-]", "_", value)
+
+
+def write_json_atomic(path: Path, data, **kwargs):
+    # Running shard processes reload their file when it changes, so they must
+    # never see it half written.
+    temp_path = path.with_name(path.name + ".tmp")
+    with temp_path.open("w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, **kwargs)
+    os.replace(temp_path, path)
+
+
+def split_gallery(encodings_path: Path, out_dir: Path, by: str, shard_count: int, base_port: int, previous: dict = None):
+    """Write one gallery file per shard plus the manifest.
+
+    With ``previous`` (the manifest being replaced), shards that still exist
+    keep their port so the matcher processes already serving them stay valid;
+    new shards get the next free ports and shards that disappeared are removed.
+    """
+    items = load_gallery_items(encodings_path)
+    shards = {}
+    for item in items:
+        shards.setdefault(shard_key(item, by, shard_count), []).append(item)
+
+    ports = {shard["name"]: shard["port"] for shard in (previous or {}).get("shards", [])}
+    next_port = max([base_port - 1, *ports.values()]) + 1
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"by": by, "shard_count": shard_count, "base_port": base_port, "created_at": time.time(), "shards": []}
+    for name in sorted(shards):
+        port = ports.get(name)
+        if port is None:
+            port, next_port = next_port, next_port + 1
+        shard_path = out_dir / f"{name}.json"
+        write_json_atomic(shard_path, shards[name])
+        manifest["shards"].append(
+            {
+                "name": name,
+                "path": shard_path.name,
+                "host": "127.0.0.1",
+                "port": port,
+                "size": len(shards[name]),
+            }
+        )
+
+    for shard in (previous or {}).get("shards", []):
+        if shard["name"] not in shards:
+            (out_dir / shard["path"]).unlink(missing_ok=True)
+
+    manifest_path = out_dir / MANIFEST_NAME
+    write_json_atomic(manifest_path, manifest, indent=2)
+    return manifest_path, manifest
+
+
+def load_manifest(manifest_path: Path):
+    with manifest_path.open("r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def manifest_path_from_env():
+    value = os.environ.get("FACE_SHARD_MANIFEST", "")
+    if not value or not Path(value).exists():
+        return None
+    return Path(value).resolve()
+
+
+def resplit(manifest_path: Path, encodings_path: Path):
+    """Re-split a freshly trained gallery with the settings of an existing manifest.
+
+    Returns the new manifest and the names of shards that have no matcher
+    process yet (``launch`` has to be restarted for those).
+    """
+    previous = load_manifest(manifest_path)
+    ports = [shard["port"] for shard in previous.get("shards", [])]
+    _, manifest = split_gallery(
+        encodings_path,
+        manifest_path.parent,
+        previous.get("by", "hash"),
+        previous.get("shard_count") or max(1, len(ports)),
+        previous.get("base_port") or min(ports, default=DEFAULT_BASE_PORT),
+        previous,
+    )
+    known = {shard["name"] for shard in previous.get("shards", [])}
+    return manifest, [shard["name"] for shard in manifest["shards"] if shard["name"] not in known]
+
+
+def top_k_matches(gallery, embedding, k: int):
+    # Same Euclidean distance as face_recognition.face_distance, computed with
+    # numpy alone so shard processes never load dlib.
+    import numpy as np
+
+    items, matrix = gallery
+    if not items:
+        return []
+    distances = np.linalg.norm(matrix - np.asarray(embedding, dtype=float), axis=1)
+    k = min(k, len(items))
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest])]
+    return [{"distance": float(distances[index]), "item": strip_encoding(items[index])} for index in nearest]
+
+
+def strip_encoding(item: dict):
+    return {key: value for key, value in item.items() if key != "encoding"}
+
+
+class ShardHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                gallery = self.server.current_gallery()
+                matches = top_k_matches(gallery, request["embedding"], int(request.get("k", DEFAULT_TOP_K)))
+                response = {"shard": self.server.shard_name, "matches": matches}
+            except Exception as exc:
+                response = {"shard": self.server.shard_name, "error": str(exc)}
+            self.wfile.write((json.dumps(response, ensure_ascii=True) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, shard_name: str, shard_path: Path):
+        super().__init__(address, ShardHandler)
+        self.shard_name = shard_name
+        self.shard_path = shard_path
+        self._lock = threading.Lock()
+        self._version = None
+        self.gallery = ([], None)
+        self.current_gallery()
+
+    def current_gallery(self):
+        # A retrain re-splits the shard files in place; one stat per request
+        # is enough to pick the new slice up without restarting the process.
+        try:
+            stat = self.shard_path.stat()
+        except OSError:
+            return self.gallery
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.gallery = build_gallery(load_gallery_items(self.shard_path))
+                    self._version = version
+        return self.gallery
+
+
+def serve_shard(shard_path: Path, name: str, host: str, port: int):
+    with ShardServer((host, port), name, shard_path) as server:
+        # Warm the distance path once so the first probe is not slower than the rest.
+        top_k_matches(server.gallery, [0.0] * 128, 1)
+        print(json.dumps({"event": "ready", "shard": name, "port": port, "size": len(server.gallery[0])}), flush=True)
+        server.serve_forever()
+
+
+def query_shard(shard: dict, embedding, k: int):
+    with socket.create_connection((shard["host"], shard["port"]), timeout=SHARD_TIMEOUT) as connection:
+        connection.sendall((json.dumps({"embedding": embedding, "k": k}) + "\n").encode("utf-8"))
+        reader = connection.makefile("r", encoding="utf-8")
+        response = json.loads(reader.readline())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response["matches"]
+
+
+def match_sharded(manifest: dict, embedding, k: int = DEFAULT_TOP_K):
+    embedding = [float(value) for value in embedding]
+    shards = manifest.get("shards", [])
+    candidates = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, len(shards))) as pool:
+        futures = [(shard, pool.submit(query_shard, shard, embedding, k)) for shard in shards]
+        for shard, future in futures:
+            try:
+                candidates.extend(future.result())
+            except Exception:
+                failed.append(shard["name"])
+
+    merged = heapq.nsmallest(k, candidates, key=lambda match: match["distance"])
+    return merged, failed
+
+
+def sharded_result(manifest: dict, embedding):
+    merged, failed = match_sharded(manifest, embedding)
+    if not merged and len(failed) == len(manifest.get("shards", [])):
+        return {"status": "fail", "message": "All gallery shards unavailable", "shards_failed": failed}
+    # The threshold is applied to the global best, never per shard.
+    if not merged or merged[0]["distance"] >= MATCH_THRESHOLD:
+        result = {"status": "fail", "message": "No match found"}
+    else:
+        result = build_match_result(merged[0]["item"], merged[0]["distance"])
+    if failed:
+        result["shards_failed"] = failed
+    return result
+
+
+def launch_shards(manifest_path: Path):
+    manifest = load_manifest(manifest_path)
+    processes = []
+    for shard in manifest["shards"]:
+        command = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "serve",
+            str(manifest_path.parent / shard["path"]),
+            "--name",
+            shard["name"],
+            "--host",
+            shard["host"],
+            "--port",
+            str(shard["port"]),
+        ]
+        processes.append(subprocess.Popen(command))
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="face_shards.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="split face_encodings.json into shard galleries")
+    split.add_argument("--encodings", default=str(default_encodings_path()))
+    split.add_argument("--out", required=True)
+    split.add_argument("--by", default="hash", help="'hash' or a record field such as class_name")
+    split.add_argument("--shards", type=int, default=4, help="shard count for --by hash")
+    split.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT)
+
+    serve = commands.add_parser("serve", help="serve one shard gallery")
+    serve.add_argument("shard")
+    serve.add_argument("--name", default="")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, required=True)
+
+    launch = commands.add_parser("launch", help="start a local matcher process per shard")
+    launch.add_argument("manifest")
+
+    match = commands.add_parser("match", help="match one image against all shards")
+    match.add_argument("image")
+    match.add_argument("--manifest", required=True)
+
+    args = parser.parse_args()
+    if args.command == "split":
+        out_dir = Path(args.out).resolve()
+        previous = load_manifest(out_dir / MANIFEST_NAME) if (out_dir / MANIFEST_NAME).exists() else None
+        manifest_path, manifest = split_gallery(
+            Path(args.encodings).resolve(), out_dir, args.by, max(1, args.shards), args.base_port, previous
+        )
+        print(json.dumps({"status": "success", "manifest": str(manifest_path), "shards": manifest["shards"]}))
+    elif args.command == "serve":
+        shard_path = Path(args.shard).resolve()
+        serve_shard(shard_path, args.name or shard_path.stem, args.host, args.port)
+    elif args.command == "launch":
+        launch_shards(Path(args.manifest).resolve())
+    elif args.command == "match":
+        import face_recognition
+
+        image = face_recognition.load_image_file(args.image)
+        encodings = face_recognition.face_encodings(image)
+        if not encodings:
+            print(json.dumps({"status": "fail", "message": "No match found"}))
+            return
+        print(json.dumps(sharded_result(load_manifest(Path(args.manifest).resolve()), encodings[0]), ensure_ascii=True))
+
+
+if __name__ == "__main__":
+    main()
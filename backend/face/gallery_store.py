@@ -0,0 +1,216 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from face_engine import default_encodings_path, iter_gallery_items
+
+# Layout of a published generation file:
+#   header (64 bytes) | float64 matrix [count x dim] | uint64 offsets [count + 1] | metadata records
+# Every worker maps the file read-only, so the embedding matrix lives once in
+# the OS page cache no matter how many face processes attach to it.
+MAGIC = b"FGAL0001"
+HEADER = struct.Struct("<8sQQQQQQ")
+HEADER_SIZE = 64
+EMBEDDING_DIM = 128
+CURRENT_NAME = "current.json"
+
+
+def default_store_dir():
+    shm = Path("/dev/shm")
+    if shm.is_dir():
+        return shm / "face_gallery"
+    return Path(__file__).resolve().parent / ".gallery_store"
+
+
+def store_dir_from_env():
+    value = os.environ.get("FACE_GALLERY_STORE", "")
+    if not value:
+        return None
+    return default_store_dir() if value == "default" else Path(value)
+
+
+def read_current(store_dir: Path):
+    try:
+        with (store_dir / CURRENT_NAME).open("r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def publish(items, store_dir: Path):
+    # items may be any iterable (e.g. streamed from face_encodings.json): the
+    # matrix is written as records arrive, metadata goes to a side file, and the
+    # header is filled in last once the count is known.
+    store_dir.mkdir(parents=True, exist_ok=True)
+    current = read_current(store_dir) or {}
+    generation = int(current.get("generation", 0)) + 1
+
+    file_name = f"gallery-{generation}.bin"
+    temp_path = store_dir / f"{file_name}.tmp"
+    meta_path = store_dir / f"{file_name}.meta.tmp"
+    offsets = array("Q", [0])
+    count = 0
+    with temp_path.open("w+b") as file, meta_path.open("w+b") as meta_file:
+        file.write(b"\0" * HEADER_SIZE)
+        for item in items:
+            file.write(struct.pack(f"<{EMBEDDING_DIM}d", *item["encoding"]))
+            meta = {key: value for key, value in item.items() if key != "encoding"}
+            record = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+            meta_file.write(record)
+            offsets.append(offsets[-1] + len(record))
+            count += 1
+
+        offsets_offset = file.tell()
+        meta_size = offsets[-1]
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        offsets.tofile(file)
+        meta_offset = file.tell()
+        meta_file.seek(0)
+        shutil.copyfileobj(meta_file, file)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, generation, count, EMBEDDING_DIM, offsets_offset, meta_offset, meta_size).ljust(HEADER_SIZE, b"\0"))
+        file.flush()
+        os.fsync(file.fileno())
+    meta_path.unlink()
+    os.replace(temp_path, store_dir / file_name)
+
+    # Swapping the pointer is the publish step; workers notice the new
+    # generation on their next refresh() and re-map.
+    pointer_temp = store_dir / f"{CURRENT_NAME}.tmp"
+    with pointer_temp.open("w", encoding="utf-8") as file:
+        json.dump({"generation": generation, "file": file_name, "count": count}, file)
+    os.replace(pointer_temp, store_dir / CURRENT_NAME)
+
+    # The previous generation is kept: a worker may have read the old pointer
+    # just before the swap and still be about to open that file. Anything older
+    # has been superseded twice; unlinking it is safe even for workers still
+    # mapping it, as the pages stay valid until they re-attach.
+    for old in store_dir.glob("gallery-*.bin"):
+        try:
+            old_generation = int(old.stem.split("-", 1)[1])
+        except ValueError:
+            continue
+        if old_generation < generation - 1:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    return generation
+
+
+class GalleryItems:
+    """Read-only sequence of gallery metadata decoded lazily from the mapping."""
+
+    def __init__(self, buffer, count: int, offsets_offset: int, meta_offset: int):
+        self._buffer = buffer
+        self._count = count
+        self._offsets = memoryview(buffer)[offsets_offset:offsets_offset + (count + 1) * 8].cast("Q")
+        self._meta_offset = meta_offset
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        start = self._meta_offset + self._offsets[index]
+        end = self._meta_offset + self._offsets[index + 1]
+        return json.loads(bytes(self._buffer[start:end]).decode("utf-8"))
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+
+class GalleryStore:
+    """Zero-copy attachment to the gallery published in a store directory."""
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self.generation = 0
+        self._pointer_mtime = None
+        self._mapping = None
+        self._gallery = None
+
+    def refresh(self):
+        # One stat() per call; the pointer is only re-read when it changed.
+        try:
+            mtime = (self.store_dir / CURRENT_NAME).stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._pointer_mtime:
+            return False
+        for attempt in range(2):
+            current = read_current(self.store_dir)
+            if not current or int(current.get("generation", 0)) == self.generation:
+                self._pointer_mtime = mtime
+                return False
+            try:
+                self._attach(self.store_dir / current["file"])
+                break
+            except FileNotFoundError:
+                # Two publishes landed between reading the pointer and opening
+                # its file; the pointer now names a newer one.
+                if attempt:
+                    if self._gallery is None:
+                        raise
+                    return False
+        self._pointer_mtime = mtime
+        return True
+
+    def _attach(self, path: Path):
+        import numpy as np
+
+        with path.open("rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, generation, count, dim, offsets_offset, meta_offset, _ = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or dim != EMBEDDING_DIM:
+            mapping.close()
+            raise ValueError(f"Invalid gallery file: {path}")
+        matrix = np.frombuffer(mapping, dtype="<f8", count=count * dim, offset=HEADER_SIZE).reshape(count, dim)
+        self._gallery = (GalleryItems(mapping, count, offsets_offset, meta_offset), matrix)
+        # The previous mapping is left to the garbage collector: callers may
+        # still hold views into it while finishing an in-flight match.
+        self._mapping = mapping
+        self.generation = generation
+
+    def gallery(self):
+        self.refresh()
+        return self._gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="gallery_store.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    publish_cmd = commands.add_parser("publish", help="publish face_encodings.json as a new generation")
+    publish_cmd.add_argument("encodings", nargs="?", default=str(default_encodings_path()))
+    publish_cmd.add_argument("--store", default="")
+
+    info_cmd = commands.add_parser("info", help="show the current generation")
+    info_cmd.add_argument("--store", default="")
+
+    args = parser.parse_args()
+    store_dir = Path(args.store) if args.store else (store_dir_from_env() or default_store_dir())
+    if args.command == "publish":
+        encodings_path = Path(args.encodings).resolve()
+        if not encodings_path.exists():
+            print(json.dumps({"status": "fail", "message": "face_encodings.json not found"}))
+            sys.exit(1)
+        publish(iter_gallery_items(encodings_path), store_dir)
+        print(json.dumps({"status": "success", "store": str(store_dir), **read_current(store_dir)}))
+    else:
+        print(json.dumps({"status": "success", "store": str(store_dir), **(read_current(store_dir) or {})}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from face_engine import default_encodings_path, iter_gallery_items
+
+# gallery_index.json assigns every gallery record the generation in which it
+# last changed, plus tombstones for removed records, so offline kiosks can
+# pull only what changed since the generation they hold.
+
+INDEX_NAME = "gallery_index.json"
+
+
+def default_index_path():
+    return Path(__file__).resolve().parent / INDEX_NAME
+
+
+def gallery_key(record: dict):
+    # Same identity train_faces uses when compacting: one key per local photo,
+    # one per avatar-trained student.
+    if record.get("source") == "local" and record.get("image_path"):
+        return "local:" + record["image_path"]
+    return "url:" + str(record.get("student_code", ""))
+
+
+def record_digest(record: dict):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=True).encode("utf-8")).hexdigest()
+
+
+def load_index(index_path: Path):
+    try:
+        with index_path.open("r", encoding="utf-8") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        index = {}
+    index.setdefault("generation", 0)
+    index.setdefault("entries", {})
+    index.setdefault("removed", {})
+    return index
+
+
+def save_index(index: dict, index_path: Path):
+    # A unique temp name per writer; os.replace keeps readers on either the
+    # old or the new file, never a partial one.
+    fd, temp_name = tempfile.mkstemp(prefix=index_path.name + ".", suffix=".tmp", dir=index_path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(index, file, ensure_ascii=False)
+        os.replace(temp_name, index_path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def index_lock(index_path: Path):
+    # Every kiosk poll runs in its own process, so load -> update -> save is
+    # serialized with an OS lock on a sidecar file; without it two updates
+    # can both bump the generation and one set of changes is lost.
+    lock_path = index_path.with_name(index_path.name + ".lock")
+    with lock_path.open("a+b") as handle:
+        if os.name == "nt":
+            import msvcrt
+
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def update_index(encodings_path: Path, index_path: Path):
+    """Bring the index in line with face_encodings.json; returns the index.
+
+    Skipped entirely while the gallery file's mtime and size are unchanged.
+    Otherwise every record is hashed once (streamed) and the generation is
+    bumped only if something was added, changed or removed.
+    """
+    with index_lock(index_path):
+        return _update_index_locked(encodings_path, index_path)
+
+
+def _update_index_locked(encodings_path: Path, index_path: Path):
+    index = load_index(index_path)
+    stat = encodings_path.stat()
+    source = {"mtime": stat.st_mtime, "size": stat.st_size}
+    if index.get("source") == source:
+        return index
+
+    next_generation = index["generation"] + 1
+    entries = index["entries"]
+    seen = set()
+    changed = False
+    for record in iter_gallery_items(encodings_path):
+        key = gallery_key(record)
+        seen.add(key)
+        digest = record_digest(record)
+        entry = entries.get(key)
+        if entry is None or entry["digest"] != digest:
+            entries[key] = {"generation": next_generation, "digest": digest}
+            index["removed"].pop(key, None)
+            changed = True
+
+    for key in [key for key in entries if key not in seen]:
+        del entries[key]
+        index["removed"][key] = next_generation
+        changed = True
+
+    if changed:
+        index["generation"] = next_generation
+    index["source"] = source
+    save_index(index, index_path)
+    return index
+
+
+def gallery_delta(encodings_path: Path, index_path: Path, since: int, field: str = "", value: str = ""):
+    index = update_index(encodings_path, index_path)
+    generation = index["generation"]
+    # A kiosk ahead of the server (index rebuilt) or starting fresh gets a
+    # full copy and replaces its local gallery.
+    full = since <= 0 or since > generation
+    delta = {"status": "success", "generation": generation, "full": full, "changed": [], "removed": []}
+    if not full and since == generation:
+        return delta
+
+    # A kiosk at a school gate usually covers several classes: --value may
+    # list them comma separated.
+    values = {part.strip() for part in value.split(",")}
+    for record in iter_gallery_items(encodings_path):
+        key = gallery_key(record)
+        if not full and index["entries"].get(key, {}).get("generation", 0) <= since:
+            continue
+        # A record that moved out of the kiosk's scope is a removal for it.
+        if field and str(record.get(field, "")) not in values:
+            if not full:
+                delta["removed"].append(key)
+            continue
+        delta["changed"].append({"key": key, **record})
+
+    if not full:
+        delta["removed"].extend(key for key, removed_at in index["removed"].items() if removed_at > since)
+    return delta
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="gallery_versions.py")
+    parser.add_argument("--encodings", default=str(default_encodings_path()))
+    parser.add_argument("--index", default=str(default_index_path()))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("update", help="assign generations to changed gallery records")
+
+    delta_cmd = commands.add_parser("delta", help="print records changed or removed since a generation")
+    delta_cmd.add_argument("--since", type=int, default=0)
+    delta_cmd.add_argument("--field", default="", help="only records whose field is in --value (e.g. class_name)")
+    delta_cmd.add_argument("--value", default="", help="comma separated values for --field")
+
+    args = parser.parse_args()
+    encodings_path = Path(args.encodings).resolve()
+    if not encodings_path.exists():
+        print(json.dumps({"status": "fail", "message": "face_encodings.json not found"}))
+        sys.exit(1)
+
+    index_path = Path(args.index).resolve()
+    if args.command == "update":
+        index = update_index(encodings_path, index_path)
+        print(json.dumps({"status": "success", "generation": index["generation"], "records": len(index["entries"])}))
+    else:
+        delta = gallery_delta(encodings_path, index_path, args.since, args.field, args.value)
+        print(json.dumps(delta, ensure_ascii=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path
+
+from face_engine import (
+    STREAM_DETECT_SCALE,
+    build_gallery,
+    build_match_result,
+    detect_stage,
+    emit_event,
+    encode_probe,
+    encode_stage,
+    match_encoding,
+    open_frame_source,
+    read_frames,
+)
+
+# Kiosk-local matching: the kiosk holds its own copy of the gallery, kept up to
+# date from /api/face/gallery/delta, matches on-box and queues attendance in an
+# on-disk spool that is replayed to /api/face/attendance/bulk whenever the
+# server is reachable. Matching never waits on the network.
+
+DEFAULT_STATE_DIR = Path(__file__).resolve().parent / ".kiosk"
+DELTA_PATH = "/api/face/gallery/delta"
+BULK_PATH = "/api/face/attendance/bulk"
+SYNC_INTERVAL = 60.0
+SPOOL_BATCH = 200
+COOLDOWN_SECONDS = 30.0
+HTTP_TIMEOUT = 10.0
+
+
+def write_json_atomic(path: Path, data):
+    temp_path = path.with_name(path.name + ".tmp")
+    with temp_path.open("w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class ServerClient:
+    def __init__(self, server_url: str, timeout: float = HTTP_TIMEOUT):
+        self.server_url = server_url.rstrip("/")
+        self.timeout = timeout
+
+    def get_json(self, path: str, params: dict):
+        url = f"{self.server_url}{path}?{urllib.parse.urlencode(params)}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def post_json(self, path: str, payload: dict):
+        request = urllib.request.Request(
+            f"{self.server_url}{path}",
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            # A 503 from a failing database still says how much was recorded.
+            try:
+                return json.loads(exc.read())
+            except ValueError:
+                raise exc
+
+
+class LocalGallery:
+    """The kiosk's copy of the gallery, keyed like the server's gallery index.
+
+    Deltas are applied to the record map and persisted atomically; the matrix
+    used for matching is rebuilt and swapped in one assignment, so a match in
+    progress keeps using the previous gallery.
+    """
+
+    def __init__(self, state_dir: Path, scope: dict):
+        self.path = state_dir / "gallery.json"
+        self.scope = scope
+        saved = {}
+        if self.path.exists():
+            try:
+                with self.path.open("r", encoding="utf-8") as file:
+                    saved = json.load(file)
+            except ValueError:
+                saved = {}
+        # A kiosk moved to another scope starts over with a full copy.
+        if saved.get("scope") != scope:
+            saved = {}
+        self.generation = int(saved.get("generation", 0))
+        self.records = saved.get("records", {})
+        self._gallery = build_gallery(list(self.records.values()))
+
+    def gallery(self):
+        return self._gallery
+
+    def merge(self, delta: dict):
+        records = {} if delta.get("full") else dict(self.records)
+        for key in delta.get("removed", []):
+            records.pop(key, None)
+        for record in delta.get("changed", []):
+            record = dict(record)
+            records[record.pop("key")] = record
+        return records
+
+    def apply(self, delta: dict, records: dict = None):
+        if records is None:
+            records = self.merge(delta)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.path, {"generation": delta["generation"], "scope": self.scope, "records": records})
+        self.records = records
+        self.generation = int(delta["generation"])
+        self._gallery = build_gallery(list(records.values()))
+
+    def sync(self, client: ServerClient):
+        if not self.records:
+            self.generation = 0
+        delta = client.get_json(DELTA_PATH, {"since": self.generation, **self.scope})
+        if delta.get("status") != "success":
+            raise RuntimeError(delta.get("message", "Delta request failed"))
+        if delta["generation"] == self.generation and not delta.get("full"):
+            return {"generation": self.generation, "changed": 0, "removed": 0}
+        records = self.merge(delta)
+        if self.scope and not records:
+            # Almost always a scope that matches no record (a field the gallery
+            # does not carry, or a typo in the value): keep whatever we have
+            # instead of silently matching against nothing.
+            return {
+                "generation": self.generation,
+                "changed": 0,
+                "removed": 0,
+                "warning": f"No gallery records with {self.scope['field']} in {self.scope['value']!r}; "
+                "local gallery kept. Records carry class_name and class_id.",
+            }
+        self.apply(delta, records)
+        return {
+            "generation": self.generation,
+            "full": bool(delta.get("full")),
+            "changed": len(delta.get("changed", [])),
+            "removed": len(delta.get("removed", [])),
+        }
+
+
+class AttendanceSpool:
+    """Append-only on-disk queue of attendance events matched offline.
+
+    New events go to ``pending.ndjson`` (fsync'ed per event). A replay first
+    renames it to ``sending-<ns>.ndjson`` so capture continues into a fresh
+    file, then posts batches; acknowledged lines are cut from the file, so a
+    crash or outage mid-replay only ever re-sends unacknowledged events.
+    """
+
+    def __init__(self, spool_dir: Path):
+        self.spool_dir = spool_dir
+        self.pending_path = spool_dir / "pending.ndjson"
+        self._lock = threading.Lock()
+
+    def append(self, event: dict):
+        with self._lock:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            with self.pending_path.open("a", encoding="utf-8") as file:
+                file.write(json.dumps(event, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _sending_files(self):
+        with self._lock:
+            if self.pending_path.exists() and self.pending_path.stat().st_size:
+                os.replace(self.pending_path, self.spool_dir / f"sending-{time.time_ns()}.ndjson")
+        return sorted(self.spool_dir.glob("sending-*.ndjson"))
+
+    def pending_count(self):
+        if not self.spool_dir.exists():
+            return 0
+        count = 0
+        for path in [self.pending_path, *self.spool_dir.glob("sending-*.ndjson")]:
+            if path.exists():
+                with path.open("r", encoding="utf-8") as file:
+                    count += sum(1 for line in file if line.strip())
+        return count
+
+    def replay(self, client: ServerClient, kiosk_id: str):
+        if not self.spool_dir.exists():
+            return 0
+        sent = 0
+        for path in self._sending_files():
+            events = []
+            with path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        continue
+            while events:
+                batch = events[:SPOOL_BATCH]
+                response = client.post_json(BULK_PATH, {"kiosk_id": kiosk_id, "events": batch})
+                # The server acknowledges a prefix of the batch; the rest stays
+                # queued. Events are upserts keyed by student and date, so
+                # re-sending after a lost acknowledgement is harmless.
+                accepted = min(int(response.get("accepted", 0)), len(batch))
+                if accepted <= 0:
+                    raise RuntimeError(response.get("message", "Bulk replay rejected"))
+                events = events[accepted:]
+                sent += accepted
+                temp_path = path.with_name(path.name + ".tmp")
+                temp_path.write_text("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events), encoding="utf-8")
+                os.replace(temp_path, path)
+            path.unlink()
+        return sent
+
+
+class KioskState:
+    def __init__(self, args):
+        self.state_dir = Path(args.state_dir).resolve()
+        self.kiosk_id = args.kiosk_id or socket.gethostname()
+        scope = {"field": args.field, "value": args.value} if args.field else {}
+        self.gallery = LocalGallery(self.state_dir, scope)
+        self.spool = AttendanceSpool(self.state_dir / "spool")
+        self.client = ServerClient(args.server, args.timeout) if args.server else None
+        self.cooldown = getattr(args, "cooldown", COOLDOWN_SECONDS)
+        self._last_seen = {}
+
+    def sync_once(self):
+        # Each step fails independently: an unreachable server leaves the local
+        # gallery and the spool exactly as they were.
+        summary = {"event": "sync", "online": False, "generation": self.gallery.generation}
+        if self.client is None:
+            return summary
+        try:
+            summary.update(self.gallery.sync(self.client))
+            summary["replayed"] = self.spool.replay(self.client, self.kiosk_id)
+            summary["online"] = True
+        except Exception as exc:
+            summary["message"] = str(exc)
+        summary["queued"] = self.spool.pending_count()
+        return summary
+
+    def recognize(self, encoding, box=None, frame=None):
+        item, distance = match_encoding(self.gallery.gallery(), encoding)
+        if item is None:
+            return {"status": "fail", "message": "No match found"}
+        result = build_match_result(item, distance)
+        now = time.time()
+        code = result["student_code"]
+        # One event per student per cooldown window, not one per video frame.
+        if now - self._last_seen.get(code, 0) >= self.cooldown:
+            self.spool.append(
+                {
+                    "event_id": uuid.uuid4().hex,
+                    "kiosk_id": self.kiosk_id,
+                    "student_code": code,
+                    "full_name": result["full_name"],
+                    "class_name": result["class_name"],
+                    "confidence": result["confidence"],
+                    "date": time.strftime("%Y-%m-%d", time.localtime(now)),
+                    "captured_at": round(now, 3),
+                    "box": list(box) if box is not None else None,
+                }
+            )
+            result["queued"] = True
+        self._last_seen[code] = now
+        return result
+
+
+def sync_loop(state: KioskState, interval: float, stop: threading.Event):
+    while not stop.is_set():
+        emit_event(state.sync_once())
+        stop.wait(interval)
+
+
+def run_camera(state: KioskState, args):
+    capture = open_frame_source(args.source)
+    if capture is None:
+        emit_event({"event": "error", "message": "Unable to open frame source"})
+        return
+
+    stop = threading.Event()
+    syncer = threading.Thread(target=sync_loop, args=(state, args.sync_interval, stop), daemon=True)
+    syncer.start()
+    stats = {"read": 0, "dropped": 0}
+    emit_event({"event": "start", "source": args.source, "generation": state.gallery.generation})
+    frames = read_frames(capture, stats)
+    try:
+        for index, timestamp, boxes, encodings in encode_stage(detect_stage(frames, args.scale)):
+            for box, encoding in zip(boxes, encodings):
+                started = time.perf_counter()
+                result = state.recognize(encoding, box)
+                emit_event(
+                    {
+                        "event": "recognition",
+                        "mode": "local",
+                        "frame": index,
+                        "timestamp": round(timestamp, 3),
+                        "box": list(box),
+                        "match_ms": round((time.perf_counter() - started) * 1000, 2),
+                        **result,
+                    }
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        frames.close()
+        capture.release()
+    emit_event({"event": "end", **stats, "queued": state.spool.pending_count()})
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="kiosk_offline.py")
+    parser.add_argument("--server", default=os.environ.get("FACE_SERVER_URL", ""), help="central server base URL")
+    parser.add_argument("--state-dir", default=os.environ.get("FACE_KIOSK_STATE_DIR", str(DEFAULT_STATE_DIR)))
+    parser.add_argument("--kiosk-id", default="")
+    parser.add_argument("--field", default="", help="gallery scope field, e.g. class_name or class_id")
+    parser.add_argument("--value", default="", help="gallery scope value(s) for --field, comma separated")
+    parser.add_argument("--timeout", type=float, default=HTTP_TIMEOUT)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="match camera frames locally, syncing in the background")
+    run.add_argument("source", help="camera index, video file or MJPEG/HTTP stream URL")
+    run.add_argument("--scale", type=float, default=STREAM_DETECT_SCALE)
+    run.add_argument("--sync-interval", type=float, default=SYNC_INTERVAL)
+    run.add_argument("--cooldown", type=float, default=COOLDOWN_SECONDS)
+
+    match = commands.add_parser("match", help="match one image against the local gallery")
+    match.add_argument("image")
+
+    commands.add_parser("sync", help="pull the gallery delta and replay queued attendance once")
+    commands.add_parser("status", help="show the local generation and queued events")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    state = KioskState(args)
+
+    if args.command == "run":
+        run_camera(state, args)
+    elif args.command == "sync":
+        print(json.dumps(state.sync_once(), ensure_ascii=True))
+    elif args.command == "status":
+        print(
+            json.dumps(
+                {
+                    "status": "success",
+                    "generation": state.gallery.generation,
+                    "records": len(state.gallery.records),
+                    "queued": state.spool.pending_count(),
+                },
+                ensure_ascii=True,
+            )
+        )
+    else:
+        image_path = Path(args.image).resolve()
+        if not image_path.exists():
+            print(json.dumps({"status": "fail", "message": "Image file not found"}))
+            return
+        encodings = encode_probe(image_path)
+        if not encodings:
+            print(json.dumps({"status": "fail", "message": "No match found"}))
+            return
+        print(json.dumps(state.recognize(encodings[0]), ensure_ascii=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import argparse
+import base64
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# Open-loop load generator for /api/face/detect and /api/face/verify.
+#
+# Arrivals are scheduled on a fixed clock (or a Poisson process) regardless of
+# how fast the server answers, and latency is measured from the scheduled
+# arrival time. A slow server therefore shows up as growing latency instead of
+# silently lowering the offered load (coordinated omission).
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+STUBS_PATH = Path(__file__).resolve().parent / "load_test_stubs.js"
+IMAGE_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+ENDPOINTS = {"detect": "/api/face/detect", "verify": "/api/face/verify"}
+BUSY_STATUSES = {429, 503}
+READY_TIMEOUT = 30.0
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_frames(frames_dir: Path):
+    frames = []
+    for path in sorted(frames_dir.rglob("*")):
+        mime = IMAGE_TYPES.get(path.suffix.lower())
+        if not mime or not path.is_file():
+            continue
+        encoded = base64.b64encode(path.read_bytes()).decode("ascii")
+        frames.append({"name": path.name, "data_url": f"data:{mime};base64,{encoded}"})
+    return frames
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(port: int, db_ms: float, log=None):
+    # log is a file the caller opened (and closes) for --server-log.
+    env = dict(os.environ, PORT=str(port), LOADTEST_DB_MS=str(db_ms))
+    process = subprocess.Popen(
+        [os.environ.get("NODE_BIN", "node"), "-r", str(STUBS_PATH), "server.js"],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=log if log is not None else subprocess.DEVNULL,
+        stderr=subprocess.STDOUT,
+    )
+    return process
+
+
+def wait_until_ready(base_url: str, process=None):
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            connection.request("GET", "/api/subjects")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready in {READY_TIMEOUT:.0f}s")
+
+
+def process_tree(root_pid: int):
+    # Reads /proc directly so the harness needs nothing beyond the stdlib; the
+    # Python engines spawned per request count towards the server's footprint.
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def rss_bytes(pid: int):
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+        self._started_at = time.monotonic()
+
+    def run(self):
+        if not Path("/proc").is_dir():
+            return
+        while not self._done.is_set():
+            pids = process_tree(self.pid)
+            self.samples.append(
+                {
+                    "t": round(time.monotonic() - self._started_at, 2),
+                    "server_rss_mb": round(rss_bytes(self.pid) / 1048576, 1),
+                    "tree_rss_mb": round(sum(rss_bytes(pid) for pid in pids) / 1048576, 1),
+                    "processes": len(pids),
+                }
+            )
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def arrival_times(rate: float, duration: float, poisson: bool, rng: random.Random):
+    offset = 0.0
+    while offset < duration:
+        yield offset
+        offset += rng.expovariate(rate) if poisson else 1.0 / rate
+
+
+class LoadRunner:
+    def __init__(self, base_url: str, frames, verify_ratio: float, concurrency: int, timeout: float, seed: int):
+        self.base_url = urlsplit(base_url)
+        self.frames = frames
+        self.verify_ratio = verify_ratio
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.results = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.base_url.hostname, self.base_url.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _post(self, path: str, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                # A keep-alive socket closed by the server between requests is
+                # retried once on a fresh connection; anything else is an error.
+                if attempt:
+                    raise
+
+    def _classify(self, endpoint: str, status: int, raw: bytes):
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = {}
+        message = str(payload.get("message", "")).lower()
+        if status in BUSY_STATUSES or "busy" in message:
+            return "busy"
+        if status >= 400:
+            return "error"
+        if endpoint == "detect":
+            return "face" if payload.get("hasFace") else "no_face"
+        return "match" if payload.get("status") == "success" else "no_match"
+
+    def _worker(self, started_at: float):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            endpoint, frame, scheduled = job
+            begin = time.monotonic()
+            try:
+                status, raw = self._post(ENDPOINTS[endpoint], {"image": frame["data_url"]})
+                outcome = self._classify(endpoint, status, raw)
+            except (OSError, http.client.HTTPException):
+                status, outcome = 0, "error"
+            end = time.monotonic()
+            with self._lock:
+                self.results.append(
+                    {
+                        "endpoint": endpoint,
+                        "outcome": outcome,
+                        "status": status,
+                        "at": begin - started_at,
+                        "latency_ms": (end - (started_at + scheduled)) * 1000,
+                        "service_ms": (end - begin) * 1000,
+                    }
+                )
+
+    def run(self, rate: float, duration: float, poisson: bool):
+        started_at = time.monotonic()
+        workers = [threading.Thread(target=self._worker, args=(started_at,), daemon=True) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+
+        offered = 0
+        for offset in arrival_times(rate, duration, poisson, self.rng):
+            delay = started_at + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = "verify" if self.rng.random() < self.verify_ratio else "detect"
+            self._queue.put((endpoint, self.rng.choice(self.frames), offset))
+            offered += 1
+
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+        return offered, time.monotonic() - started_at
+
+
+def percentile(sorted_values, pct: float):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile.
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index], 1)
+
+
+def latency_summary(values):
+    ordered = sorted(values)
+    summary = {f"p{pct}": percentile(ordered, pct) for pct in PERCENTILES}
+    summary["max"] = round(ordered[-1], 1) if ordered else None
+    summary["mean"] = round(sum(ordered) / len(ordered), 1) if ordered else None
+    return summary
+
+
+def summarize(results, elapsed: float):
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        rows = [row for row in results if row["endpoint"] == endpoint]
+        if not rows:
+            continue
+        outcomes = {}
+        for row in rows:
+            outcomes[row["outcome"]] = outcomes.get(row["outcome"], 0) + 1
+        answered = [row for row in rows if row["outcome"] not in ("error", "busy")]
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(answered) / elapsed, 2) if elapsed else 0,
+            "outcomes": outcomes,
+            "error_rate": round(outcomes.get("error", 0) / len(rows), 4),
+            "busy_rate": round(outcomes.get("busy", 0) / len(rows), 4),
+            "latency_ms": latency_summary([row["latency_ms"] for row in answered]),
+            "service_ms": latency_summary([row["service_ms"] for row in answered]),
+        }
+    return endpoints
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="load_test.py", description="Replay recorded frames against the face endpoints")
+    parser.add_argument("--frames", required=True, help="directory of recorded .jpg/.png frames (kiosk captures)")
+    parser.add_argument("--url", default="", help="target an already running server instead of spawning one")
+    parser.add_argument("--server-pid", type=int, default=0, help="pid to sample RSS from when using --url")
+    parser.add_argument("--rate", type=float, default=2.0, help="arrivals per second across all kiosks")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of offered load")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight requests (simulated kiosks)")
+    parser.add_argument("--verify-ratio", type=float, default=0.3, help="share of arrivals that go to /verify")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival gaps instead of a fixed clock")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--db-ms", type=float, default=5.0, help="simulated attendance DB latency for the stub")
+    parser.add_argument("--rss-interval", type=float, default=1.0)
+    parser.add_argument("--server-log", default="", help="append spawned server output to this file")
+    parser.add_argument("--label", default="", help="build label stored in the report")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="", help="write the JSON report here as well as stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    frames = load_frames(Path(args.frames))
+    if not frames:
+        print(json.dumps({"status": "fail", "message": f"No .jpg/.png frames found in {args.frames}"}))
+        sys.exit(1)
+    if args.rate <= 0 or args.concurrency <= 0:
+        print(json.dumps({"status": "fail", "message": "--rate and --concurrency must be positive"}))
+        sys.exit(1)
+
+    server = None
+    server_log = None
+    base_url = args.url.rstrip("/")
+    server_pid = args.server_pid
+    if not base_url:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        if args.server_log:
+            server_log = open(args.server_log, "ab")
+        server = spawn_server(port, args.db_ms, server_log)
+        server_pid = server.pid
+
+    sampler = None
+    try:
+        wait_until_ready(base_url, server)
+        if server_pid:
+            sampler = RssSampler(server_pid, args.rss_interval)
+            sampler.start()
+        runner = LoadRunner(base_url, frames, args.verify_ratio, args.concurrency, args.timeout, args.seed)
+        offered, elapsed = runner.run(args.rate, args.duration, args.poisson)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if server_log is not None:
+            server_log.close()
+
+    results = runner.results
+    answered = [row for row in results if row["outcome"] not in ("error", "busy")]
+    rss = sampler.samples if sampler else []
+    report = {
+        "status": "success",
+        "label": args.label,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "url": base_url,
+            "spawned": server is not None,
+            "frames": len(frames),
+            "rate": args.rate,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "verify_ratio": args.verify_ratio,
+            "arrivals": "poisson" if args.poisson else "fixed",
+            "db_ms": args.db_ms if server is not None else None,
+        },
+        "offered": offered,
+        "completed": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "offered_rps": round(offered / args.duration, 2),
+        "throughput_rps": round(len(answered) / elapsed, 2) if elapsed else 0,
+        "error_rate": round(sum(row["outcome"] == "error" for row in results) / len(results), 4) if results else 0,
+        "busy_rate": round(sum(row["outcome"] == "busy" for row in results) / len(results), 4) if results else 0,
+        "latency_ms": latency_summary([row["latency_ms"] for row in answered]),
+        "endpoints": summarize(results, elapsed),
+        "rss": {
+            "peak_server_mb": max((sample["server_rss_mb"] for sample in rss), default=None),
+            "peak_tree_mb": max((sample["tree_rss_mb"] for sample in rss), default=None),
+            "samples": rss,
+        },
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=True))
+
+
+if __name__ == "__main__":
+    main()
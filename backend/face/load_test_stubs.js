@@ -0,0 +1,65 @@
+// Preloaded by load_test.py (`node -r backend/face/load_test_stubs.js server.js`).
+// Swaps Postgres, attendanceService and the Arduino serial port for in-memory
+// stand-ins so the face endpoints can be load tested without the real hardware
+// or database. Nothing here is loaded by the normal server.
+const path = require("path");
+const Module = require("module");
+
+const ROOT = path.resolve(__dirname, "..", "..");
+const DB_DELAY_MS = Number(process.env.LOADTEST_DB_MS || 5);
+
+function stub(relativePath, exports) {
+  const filename = require.resolve(path.join(ROOT, relativePath));
+  const mod = new Module(filename, module);
+  mod.filename = filename;
+  mod.loaded = true;
+  mod.exports = exports;
+  require.cache[filename] = mod;
+}
+
+function delay(ms) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+const emptyResult = { rows: [], rowCount: 0 };
+const pool = {
+  query: async () => {
+    await delay(DB_DELAY_MS);
+    return emptyResult;
+  },
+  connect: async () => ({
+    query: pool.query,
+    release: () => { }
+  }),
+  end: async () => { }
+};
+
+stub("backend/config/db.js", {
+  pool,
+  query: (text, params) => pool.query(text, params)
+});
+
+stub("backend/services/attendanceService.js", {
+  listAttendance: async () => [],
+  listFaceAttendance: async () => [],
+  saveManualAttendance: async () => ({ saved: 0 }),
+  recordFaceAttendance: async (result, pickedDate) => {
+    // Same shape as the real transaction, after one simulated round trip.
+    await delay(DB_DELAY_MS);
+    const date = pickedDate || new Date().toISOString().slice(0, 10);
+    return {
+      student: {
+        student_code: result.student_code,
+        full_name: result.full_name,
+        class_id: result.class_name
+      },
+      attendance: { date, status: "present", confidence: result.confidence }
+    };
+  }
+});
+
+stub("backend/iot/arduino.service.js", {
+  sendToArduino: () => { }
+});
+
+console.log(`[LOADTEST] Stubbed db, attendanceService and serial port (db delay ${DB_DELAY_MS}ms)`);
@@ -1,28 +1,84 @@
+import argparse
 import json
+import os
 import sys
+import time
 import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
 import face_recognition
 
-MATCH_THRESHOLD = 0.65
+from avatar_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, DEFAULT_MAX_PER_HOST, AvatarCache, ConnectionPool
+from face_engine import MATCH_THRESHOLD, iter_gallery_items
+from face_shards import manifest_path_from_env, resplit
+from gallery_store import publish, store_dir_from_env
+
+LOCAL_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+CHECKPOINT_EVERY = 25
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+PROGRESS_INTERVAL = 1.0
+
+
+def is_ndjson_roster(train_input_path: Path):
+    if train_input_path.suffix.lower() in NDJSON_SUFFIXES:
+        return True
+    # Sniff the first line: one complete student object means NDJSON, while
+    # "[", "{" or a one-line {"students": [...]} means a JSON document.
+    with train_input_path.open("r", encoding="utf-8-sig") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                first = json.loads(line)
+            except ValueError:
+                return False
+            return isinstance(first, dict) and not isinstance(first.get("students"), list)
+    return False
 
 
 def load_train_input(train_input_path: Path):
+    """Yield raw roster records from an NDJSON (one student per line) or JSON file.
+
+    NDJSON is streamed line by line, so memory does not grow with the roster;
+    the legacy ``{"students": [...]}`` / list documents are still accepted.
+    """
     if not train_input_path or not train_input_path.exists():
-        return []
+        return
+    try:
+        ndjson = is_ndjson_roster(train_input_path)
+    except OSError:
+        return
+
+    if ndjson:
+        with train_input_path.open("r", encoding="utf-8-sig") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        return
+
     try:
         with train_input_path.open("r", encoding="utf-8-sig") as file:
             data = json.load(file)
     except Exception:
-        return []
-
+        return
     if isinstance(data, dict) and isinstance(data.get("students"), list):
-        return data["students"]
-    if isinstance(data, list):
-        return data
-    return []
+        yield from data["students"]
+    elif isinstance(data, list):
+        yield from data
+
+
+def iter_students(train_input_path: Path):
+    for raw in load_train_input(train_input_path):
+        meta = build_student_meta(raw)
+        if meta:
+            yield meta
 
 
 def safe_text(value):
@@ -52,18 +108,278 @@ def is_http_url(value):
     return value.startswith("http://") or value.startswith("https://")
 
 
-def encode_from_url(image_url: str):
+def encode_from_bytes(content: bytes):
+    image = face_recognition.load_image_file(BytesIO(content))
+    encodings = face_recognition.face_encodings(image)
+    if not encodings:
+        return None
+    return encodings[0]
+
+
+def encode_from_url(image_url: str, cache: AvatarCache = None):
+    if cache is not None:
+        return encode_from_bytes(cache.fetch(image_url))
     request = urllib.request.Request(
         image_url,
         headers={"User-Agent": "Mozilla/5.0 FaceTrainer/1.0"},
     )
     with urllib.request.urlopen(request, timeout=15) as response:
         content = response.read()
-    image = face_recognition.load_image_file(BytesIO(content))
-    encodings = face_recognition.face_encodings(image)
+    return encode_from_bytes(content)
+
+
+def prefetch_avatars(cache: AvatarCache, items, workers: int):
+    # Downloads run ahead of encoding on a thread pool, but only a bounded
+    # window of images is held in memory at once; results keep roster order.
+    window = deque()
+    iterator = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in iterator:
+            window.append((item, pool.submit(cache.fetch, item["avatar_url"])))
+            if len(window) >= workers * 2:
+                break
+        while window:
+            item, future = window.popleft()
+            next_item = next(iterator, None)
+            if next_item is not None:
+                window.append((next_item, pool.submit(cache.fetch, next_item["avatar_url"])))
+            try:
+                yield item, future.result(), None
+            except Exception as exc:
+                yield item, None, exc
+
+
+def student_code_from_path(local_dir: Path, image_path: Path):
+    # <local_dir>/<student_code>/<any>.jpg  or  <local_dir>/<student_code>[_<n>].jpg
+    relative = image_path.relative_to(local_dir)
+    if len(relative.parts) > 1:
+        return safe_text(relative.parts[0])
+    stem = image_path.stem
+    head, sep, tail = stem.rpartition("_")
+    if sep and head and tail.isdigit():
+        return safe_text(head)
+    return safe_text(stem)
+
+
+def scan_local_images(local_dir: Path):
+    images = []
+    for root, dirs, files in os.walk(local_dir):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(files):
+            if name.lower().endswith(LOCAL_IMAGE_EXTENSIONS):
+                images.append(Path(root) / name)
+    return images
+
+
+def load_previous_local_records(output_path: Path):
+    if not output_path.exists():
+        return {}
+    previous = {}
+    try:
+        for item in iter_gallery_items(output_path):
+            if item.get("source") == "local" and item.get("image_path"):
+                previous[item["image_path"]] = item
+    except Exception:
+        return {}
+    return previous
+
+
+def encode_local_file(image_path: str):
+    try:
+        image = face_recognition.load_image_file(image_path)
+        encodings = face_recognition.face_encodings(image)
+    except Exception:
+        return image_path, None
     if not encodings:
+        return image_path, None
+    return image_path, encodings[0].tolist()
+
+
+def train_from_local_dir(local_dir: Path, students_by_code: dict, previous: dict, workers: int, on_record):
+    # Records are handed to on_record as they finish (None for a photo without
+    # a usable face) instead of being collected, so memory stays flat.
+    for meta in iter_students(local_dir / "students.json"):
+        if meta["student_code"] not in students_by_code:
+            students_by_code[meta["student_code"]] = meta
+
+    trained = 0
+    pending = {}
+    for image_path in scan_local_images(local_dir):
+        student_code = student_code_from_path(local_dir, image_path)
+        if not student_code:
+            continue
+        stat = image_path.stat()
+        key = str(image_path.resolve())
+        meta = students_by_code.get(student_code, {})
+        record = {
+            "student_code": student_code,
+            "full_name": meta.get("full_name", ""),
+            "class_name": meta.get("class_name", ""),
+            "class_id": meta.get("class_id", ""),
+            "student_id": meta.get("id"),
+            "avatar_url": "",
+            "source": "local",
+            "image_path": key,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        }
+        cached = previous.get(key)
+        if cached and cached.get("mtime") == stat.st_mtime and cached.get("size") == stat.st_size:
+            record["encoding"] = cached.get("encoding", [])
+            trained += 1
+            on_record(record)
+            continue
+        pending[key] = record
+
+    skipped = 0
+    reused = trained
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for key, encoding in pool.map(encode_local_file, list(pending), chunksize=8):
+                record = pending.pop(key)
+                if encoding is None:
+                    skipped += 1
+                    on_record(None)
+                    continue
+                record["encoding"] = encoding
+                trained += 1
+                on_record(record)
+
+    return trained, skipped, reused
+
+
+class TrainCheckpoint:
+    """Append-only NDJSON log of finished students, replayed to resume a job.
+
+    Each line is flushed as it is written and fsync'ed every
+    ``CHECKPOINT_EVERY`` lines, so a killed process loses at most the last
+    partial line, which ``load`` ignores.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._unsynced = 0
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def append(self, entry: dict):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= CHECKPOINT_EVERY:
+            self.sync()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def record_key(entry: dict):
+    record = entry.get("record")
+    if not record:
         return None
-    return encodings[0]
+    if entry.get("source") == "local":
+        return "local:" + record["image_path"]
+    return "url:" + record["student_code"]
+
+
+def compact_records(log: TrainCheckpoint, output_path: Path):
+    """Write the gallery from the append-only record log; returns the record count.
+
+    Two streaming passes: the first finds the last line per image/student and
+    which local lines belong to the completed local phase (between the last
+    ``local_start`` marker and ``local_done``), the second copies those lines.
+    """
+    last_line = {}
+    local_start = -1
+    local_done = None
+    for index, entry in enumerate(log.load()):
+        phase = entry.get("phase")
+        if phase == "local_start":
+            local_start = index
+        elif phase == "local_done":
+            local_done = index
+        else:
+            key = record_key(entry)
+            if key:
+                last_line[key] = index
+
+    count = 0
+    temp_path = output_path.with_name(output_path.name + ".tmp")
+    with temp_path.open("w", encoding="utf-8") as file:
+        file.write("[\n")
+        for index, entry in enumerate(log.load()):
+            key = record_key(entry)
+            if not key or last_line.get(key) != index:
+                continue
+            if entry.get("source") == "local" and (local_done is None or not local_start < index < local_done):
+                continue
+            # One record per line keeps the file valid JSON for json.load while
+            # letting iter_gallery_items stream it back.
+            file.write(("" if not count else ",\n") + json.dumps(entry["record"], ensure_ascii=False))
+            count += 1
+        file.write("\n]\n")
+    os.replace(temp_path, output_path)
+    return count
+
+
+class ProgressReporter:
+    def __init__(self, enabled: bool, counters: dict):
+        self.enabled = enabled
+        self.counters = counters
+        self._last = 0.0
+
+    def emit(self, phase: str, done: int, total: int, force: bool = False):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        event = {"event": "progress", "phase": phase, "done": done, "total": total, **self.counters}
+        sys.stdout.write(json.dumps(event, ensure_ascii=True) + "\n")
+        sys.stdout.flush()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="train_faces.py")
+    parser.add_argument("train_input", nargs="?", help="NDJSON roster (one student per line) or JSON ({students: [...]} or list)")
+    parser.add_argument(
+        "--local-dir",
+        default=os.environ.get("FACE_LOCAL_DIR", ""),
+        help="folder of photos named or foldered by student_code",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--fetch-workers", type=int, default=8)
+    parser.add_argument("--max-per-host", type=int, default=DEFAULT_MAX_PER_HOST)
+    parser.add_argument("--cache-dir", default=os.environ.get("FACE_AVATAR_CACHE_DIR", str(DEFAULT_CACHE_DIR)))
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=int(os.environ.get("FACE_AVATAR_CACHE_MAX_MB", DEFAULT_CACHE_MAX_BYTES // (1024 * 1024))),
+    )
+    parser.add_argument("--job-dir", default="", help="checkpoint directory; rerunning with it resumes the job")
+    parser.add_argument("--progress", action="store_true", help="emit NDJSON progress events on stdout")
+    return parser.parse_args(argv)
 
 
 def main():
@@ -71,50 +387,143 @@ def main():
     output_path = current_file.parent / "face_encodings.json"
     train_input_path = current_file.parent / "train_input.json"
 
-    if len(sys.argv) >= 2:
-        train_input_path = Path(sys.argv[1]).resolve()
-
-    remote_students_raw = load_train_input(train_input_path)
-    remote_students = []
-    for item in remote_students_raw:
-        meta = build_student_meta(item)
-        if not meta:
-            continue
-        remote_students.append(meta)
+    args = parse_args(sys.argv[1:])
+    if args.train_input:
+        train_input_path = Path(args.train_input).resolve()
 
-    results = []
     trained_codes = set()
-    processed = 0
-    skipped = 0
-    trained_from_local = 0
-    trained_from_url = 0
-    skipped_local = 0
-    skipped_url = 0
-
-    for item in remote_students:
-        student_code = item.get("student_code", "")
-        avatar_url = item.get("avatar_url", "")
-        if not student_code or not is_http_url(avatar_url):
-            skipped += 1
-            skipped_url += 1
-            continue
-        if student_code in trained_codes:
-            continue
+    attempted_url_codes = set()
+    counters = {
+        "trained": 0,
+        "trained_from_local": 0,
+        "trained_from_url": 0,
+        "skipped": 0,
+        "skipped_local": 0,
+        "skipped_url": 0,
+        "reused_local": 0,
+        "resumed": 0,
+    }
+    progress = ProgressReporter(args.progress, counters)
+    local_dir = Path(args.local_dir).resolve() if args.local_dir else None
 
-        try:
-            encoding = encode_from_url(avatar_url)
-        except Exception:
-            skipped += 1
-            skipped_url += 1
-            continue
+    # Every finished student is appended to a record log and the gallery is
+    # compacted from it at the end, so encodings are never all held in memory.
+    # With --job-dir the log is the job checkpoint: replaying it resumes an
+    # interrupted job. Local entries are only trusted once the whole local
+    # phase completed; otherwise they just seed the mtime+size cache.
+    if args.job_dir:
+        log = TrainCheckpoint(Path(args.job_dir).resolve() / "checkpoint.ndjson")
+    else:
+        log = TrainCheckpoint(output_path.with_name("face_encodings.records.ndjson"))
+        if log.path.exists():
+            log.path.unlink()
 
-        if encoding is None:
-            skipped += 1
-            skipped_url += 1
-            continue
+    local_done = False
+    replayed_local = {}
+    for entry in log.load():
+        record = entry.get("record")
+        if entry.get("phase") == "local_start":
+            replayed_local.clear()
+        elif entry.get("phase") == "local_done":
+            local_done = True
+            counters["skipped_local"] = entry.get("skipped_local", 0)
+            counters["reused_local"] = entry.get("reused_local", 0)
+        elif entry.get("source") == "local":
+            if record:
+                replayed_local[record["image_path"]] = record
+        elif record:
+            trained_codes.add(record["student_code"])
+            counters["trained_from_url"] += 1
+        else:
+            attempted_url_codes.add(entry.get("student_code"))
+            counters["skipped"] += 1
+            counters["skipped_url"] += 1
 
-        results.append(
-            {
+    previous_local = {}
+    if local_done:
+        trained_codes.update(record["student_code"] for record in replayed_local.values())
+        counters["trained_from_local"] = len(replayed_local)
+        counters["skipped"] += counters["skipped_local"]
+    elif local_dir:
+        previous_local = load_previous_local_records(output_path)
+        previous_local.update(replayed_local)
+    replayed_local = None
+    counters["trained"] = counters["trained_from_local"] + counters["trained_from_url"]
+    counters["resumed"] = counters["trained"]
+
+    # Local photos take precedence: students enrolled from the on-prem archive
+    # are not downloaded again from their avatar_url.
+    if local_dir and local_dir.is_dir() and not local_done:
+        students_by_code = {item["student_code"]: item for item in iter_students(train_input_path)}
+        local_seen = [0]
+
+        def on_local_record(record):
+            local_seen[0] += 1
+            if record is not None:
+                trained_codes.add(record["student_code"])
+                log.append({"student_code": record["student_code"], "source": "local", "record": record})
+            progress.emit("local", local_seen[0], 0)
+
+        log.append({"phase": "local_start"})
+        trained_local, skipped_local, reused_local = train_from_local_dir(
+            local_dir, students_by_code, previous_local, max(1, args.workers), on_local_record
+        )
+        students_by_code = previous_local = None
+        counters["trained_from_local"] = trained_local
+        counters["trained"] += trained_local
+        counters["skipped_local"] = skipped_local
+        counters["reused_local"] = reused_local
+        counters["skipped"] += skipped_local
+        log.append({"phase": "local_done", "skipped_local": skipped_local, "reused_local": reused_local})
+        progress.emit("local", local_seen[0], local_seen[0], force=True)
+
+    # The roster is streamed twice (count, then fetch) rather than loaded.
+    roster = {"size": 0, "invalid_url": 0}
+
+    def url_students():
+        roster["size"] = roster["invalid_url"] = 0
+        for item in iter_students(train_input_path):
+            roster["size"] += 1
+            if not is_http_url(item.get("avatar_url", "")):
+                roster["invalid_url"] += 1
+                continue
+            if item["student_code"] in trained_codes or item["student_code"] in attempted_url_codes:
+                continue
+            yield item
+
+    url_total = sum(1 for _ in url_students())
+    counters["skipped"] += roster["invalid_url"]
+    counters["skipped_url"] += roster["invalid_url"]
+
+    cache = AvatarCache(
+        cache_dir=Path(args.cache_dir),
+        max_bytes=args.cache_max_mb * 1024 * 1024,
+        pool=ConnectionPool(max_per_host=max(1, args.max_per_host)),
+    )
+    try:
+        done = 0
+        for item, content, error in prefetch_avatars(cache, url_students(), max(1, args.fetch_workers)):
+            done += 1
+            progress.emit("url", done, url_total)
+            student_code = item.get("student_code", "")
+            avatar_url = item.get("avatar_url", "")
+            if student_code in trained_codes:
+                continue
+
+            try:
+                if error is not None:
+                    raise error
+                encoding = encode_from_bytes(content)
+            except Exception:
+                encoding = None
+
+            if encoding is None:
+                counters["skipped"] += 1
+                counters["skipped_url"] += 1
+                log.append({"student_code": student_code, "source": "avatar_url", "record": None})
+                continue
+
+            record = {
                 "student_code": student_code,
                 "full_name": item.get("full_name", ""),
                 "class_name": item.get("class_name", ""),
@@ -124,13 +533,33 @@ def main():
                 "source": "avatar_url",
                 "encoding": encoding.tolist(),
             }
-        )
-        trained_codes.add(student_code)
-        processed += 1
-        trained_from_url += 1
+            log.append({"student_code": student_code, "source": "avatar_url", "record": record})
+            trained_codes.add(student_code)
+            counters["trained"] += 1
+            counters["trained_from_url"] += 1
+
+    finally:
+        cache.close()
+    progress.emit("url", done, url_total, force=True)
+    log.close()
+
+    counters["trained"] = compact_records(log, output_path)
+    if not args.job_dir:
+        log.path.unlink()
+
+    # Running face workers attached to the shared gallery pick up the new
+    # generation on their next request.
+    store_dir = store_dir_from_env()
+    if store_dir is not None:
+        counters["gallery_generation"] = publish(iter_gallery_items(output_path), store_dir)
 
-    with output_path.open("w", encoding="utf-8") as file:
-        json.dump(results, file, indent=2, ensure_ascii=False)
+    # Shard matchers reload their slice when its file changes; shards that did
+    # not exist before still need `face_shards.py launch` to be restarted.
+    manifest_path = manifest_path_from_env()
+    if manifest_path is not None:
+        manifest, new_shards = resplit(manifest_path, output_path)
+        counters["shards"] = len(manifest["shards"])
+        counters["new_shards"] = new_shards
 
     print(
         json.dumps(
@@ -138,13 +567,9 @@ def main():
                 "status": "success",
                 "message": "Training completed",
                 "match_threshold": MATCH_THRESHOLD,
-                "trained": processed,
-                "trained_from_local": trained_from_local,
-                "trained_from_url": trained_from_url,
-                "skipped": skipped,
-                "skipped_local": skipped_local,
-                "skipped_url": skipped_url,
-                "candidate_urls": len(remote_students),
+                **counters,
+                "avatar_cache": cache.stats,
+                "candidate_urls": roster["size"],
                 "output": str(output_path),
             },
             ensure_ascii=True,
@@ -1,54 +1,182 @@
+import json
 import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
-def sync_and_rename_dataset(folder_path, prefix="student"):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.jfif')
+MANIFEST_NAME = '.rename_manifest.json'
+TEMP_PREFIX = '.tmp_rename_'
+# Cạnh dài tối đa hợp lý cho face encoding (dlib không cần ảnh to hơn)
+FACE_MAX_SIDE = 1024
+
+
+def load_manifest(folder_path, prefix, max_side):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Đổi prefix hoặc max_side thì manifest cũ không còn đúng nữa
+    if data.get('prefix') != prefix or data.get('max_side') != max_side:
+        return {}
+    return data.get('files', {})
+
+
+def save_manifest(folder_path, prefix, max_side, files):
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'prefix': prefix, 'max_side': max_side, 'files': files}, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def inspect_image(path, max_side):
+    # Chỉ đọc header, không decode cả ảnh
+    try:
+        with Image.open(path) as img:
+            ok = img.format == 'JPEG' and img.mode == 'RGB'
+            if max_side and max(img.size) > max_side:
+                ok = False
+            return 'jpeg' if ok else 'convert'
+    except Exception:
+        return 'broken'
+
+
+def convert_image(task):
+    # Chạy trong process pool: mở, chuyển RGB, thu nhỏ rồi ghi ra file tạm
+    src_path, tmp_path, max_side = task
+    try:
+        with Image.open(src_path) as img:
+            rgb_img = img.convert('RGB')
+            if max_side and max(rgb_img.size) > max_side:
+                rgb_img.thumbnail((max_side, max_side), Image.LANCZOS)
+            rgb_img.save(tmp_path, "JPEG", quality=95)
+        return src_path, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return src_path, str(e)
+
+
+def plan_targets(names, reserved, prefix):
+    # Đánh số lại theo thứ tự, bỏ qua tên đang bị file hỏng chiếm giữ
+    targets = {}
+    index = 1
+    for name in names:
+        while True:
+            target = f"{prefix}_{str(index).zfill(3)}.jpg"
+            index += 1
+            if target not in reserved:
+                break
+        targets[name] = target
+    return targets
+
+
+def sync_and_rename_dataset(folder_path, prefix="student", max_side=None, workers=None):
     if not os.path.exists(folder_path):
         print("Folder không tồn tại bro ơi!")
         return
 
     # Lấy tất cả các file trong folder
-    all_files = [f for f in os.listdir(folder_path)]
+    # File tạm còn sót lại (lần trước bị ngắt giữa chừng) vẫn là ảnh thật, gom vào luôn
+    all_files = [f for f in os.listdir(folder_path) if not f.startswith('.') or f.startswith(TEMP_PREFIX)]
     # Chỉ lọc các file có định dạng ảnh
-    image_extensions = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.jfif')
-    image_files = [f for f in all_files if f.lower().endswith(image_extensions)]
-    
+    image_files = [f for f in all_files if f.lower().endswith(IMAGE_EXTENSIONS)]
+
     # Sort để đổi tên cho đúng thứ tự
     image_files.sort()
 
     print(f"--- Bắt đầu đồng bộ {len(image_files)} ảnh về định dạng .jpg ---")
 
-    for index, filename in enumerate(image_files):
-        old_path = os.path.join(folder_path, filename)
-        
-        try:
-            # 1. Mở ảnh bất kể định dạng
-            with Image.open(old_path) as img:
-                # 2. Chuyển về RGB (quan trọng để tránh lỗi khi lưu JPG từ PNG/WebP)
-                rgb_img = img.convert('RGB')
-                
-                # 3. Tạo tên mới chuẩn OCD (ví dụ: student_001.jpg)
-                new_filename = f"{prefix}_{str(index + 1).zfill(3)}.jpg"
-                new_path = os.path.join(folder_path, new_filename)
-                
-                # 4. Lưu ảnh mới
-                rgb_img.save(new_path, "JPEG", quality=95)
-            
-            # 5. Xóa file cũ nếu tên nó khác tên mới (tránh xóa nhầm file vừa tạo)
-            if filename != new_filename:
-                os.remove(old_path)
-                
-            if (index + 1) % 50 == 0:
-                print(f"Đã xử lý xong: {index + 1} tấm...")
-
-        except Exception as e:
-            print(f"Lỗi khi xử lý file {filename}: {e}")
+    # 1. Kiểm tra ảnh: file nào đã có trong manifest (đúng size + mtime) thì khỏi mở lại
+    manifest = load_manifest(folder_path, prefix, max_side)
+    kinds = {}
+    for filename in image_files:
+        path = os.path.join(folder_path, filename)
+        if manifest.get(filename) == file_signature(path):
+            kinds[filename] = 'jpeg'
+        else:
+            kinds[filename] = inspect_image(path, max_side)
+
+    broken = {name for name, kind in kinds.items() if kind == 'broken'}
+    for filename in sorted(broken):
+        print(f"Lỗi khi xử lý file {filename}: không mở được ảnh")
+
+    good_files = [f for f in image_files if f not in broken]
+    targets = plan_targets(good_files, broken, prefix)
+
+    # 2. Phase 1: convert song song ra file tạm, chưa đụng vào file gốc
+    tmp_names = {}
+    tasks = []
+    unchanged = 0
+    for filename in good_files:
+        if kinds[filename] == 'jpeg' and targets[filename] == filename:
+            unchanged += 1
+            continue
+        tmp_names[filename] = f"{TEMP_PREFIX}{uuid.uuid4().hex}.jpg"
+        if kinds[filename] == 'convert':
+            tasks.append((os.path.join(folder_path, filename), os.path.join(folder_path, tmp_names[filename]), max_side))
+
+    failed = set()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for done, (src_path, error) in enumerate(pool.map(convert_image, tasks, chunksize=16), start=1):
+                if error:
+                    filename = os.path.basename(src_path)
+                    failed.add(filename)
+                    tmp_names.pop(filename, None)
+                    print(f"Lỗi khi xử lý file {filename}: {error}")
+                if done % 50 == 0:
+                    print(f"Đã xử lý xong: {done} tấm...")
+
+    # 3. Phase 2: file lỗi vẫn nằm nguyên chỗ cũ, tên của nó không được ghi đè.
+    # File nào bị chặn thì cũng nằm yên, nên lặp tới khi tập tên bị chặn không đổi.
+    blocked = set(broken) | failed
+    while True:
+        staying = {name for name in tmp_names if targets[name] in blocked}
+        if staying <= blocked:
+            break
+        blocked |= staying
+    moves = {name: targets[name] for name in tmp_names if targets[name] not in blocked}
+    for name in set(tmp_names) - set(moves):
+        os.remove(os.path.join(folder_path, tmp_names[name]))
+        print(f"Giữ nguyên {name}: tên {targets[name]} đang bị file lỗi chiếm")
+
+    # Dọn file gốc trước (ảnh chỉ cần đổi tên thì chuyển sang tên tạm), rồi mới đặt tên mới
+    for filename in moves:
+        src_path = os.path.join(folder_path, filename)
+        tmp_path = os.path.join(folder_path, tmp_names[filename])
+        if kinds[filename] == 'jpeg':
+            os.replace(src_path, tmp_path)
+        else:
+            os.remove(src_path)
+    for filename, target in moves.items():
+        os.replace(os.path.join(folder_path, tmp_names[filename]), os.path.join(folder_path, target))
+
+    # 4. Ghi manifest để lần chạy sau gần như không phải làm gì
+    new_manifest = {}
+    for filename in good_files:
+        if filename in failed or (filename in tmp_names and filename not in moves):
+            continue
+        target = targets[filename]
+        new_manifest[target] = file_signature(os.path.join(folder_path, target))
+    save_manifest(folder_path, prefix, max_side, new_manifest)
 
+    renamed = sum(1 for name in moves if kinds[name] == 'jpeg')
     print("\n--- KẾT QUẢ ---")
     print(f"Tất cả ảnh đã được chuyển về .jpg và rename sạch sẽ!")
+    print(f"Convert: {len(moves) - renamed} | Chỉ đổi tên: {renamed} | Giữ nguyên: {unchanged} | Lỗi: {len(broken) + len(failed)}")
     print(f"Folder: {os.path.abspath(folder_path)}")
 
 # Triển khai luôn cho folder của bro
 if __name__ == "__main__":
     # Nhớ điền đúng tên folder chứa đống ảnh "cực phẩm" của bro vào đây
-    target_folder = 'face_datasheet' 
-    sync_and_rename_dataset(target_folder, prefix="student_pro")
\ No newline at end of file
+    target_folder = 'face_datasheet'
+    sync_and_rename_dataset(target_folder, prefix="student_pro", max_side=FACE_MAX_SIDE)
@@ -1,9 +1,125 @@
+import hashlib
 import os
+import queue
+import threading
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import messagebox
 from PIL import Image, ImageTk
 from send2trash import send2trash # Thư viện để đưa file vào thùng rác
 
+THUMB_SIZE = (500, 500)
+PREFETCH_AHEAD = 5 # Số ảnh load trước mỗi chiều (next/prev)
+MEMORY_CACHE_SIZE = 48 # Số thumbnail giữ trong RAM
+THUMB_CACHE_DIR = '.thumb_cache'
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Trần dung lượng cache đĩa, vượt thì xóa file cũ nhất
+
+
+class ThumbnailLoader:
+    """Load thumbnail ở thread nền: LRU trong RAM + cache trên đĩa theo path+mtime."""
+
+    def __init__(self, folder_path, image_paths=()):
+        self.cache_dir = os.path.join(folder_path, THUMB_CACHE_DIR)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.wanted = set()
+        threading.Thread(target=self.prune, args=(list(image_paths),), daemon=True).start()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def _disk_path(self, img_path):
+        stat = os.stat(img_path)
+        key = f"{os.path.abspath(img_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jpg')
+
+    def prune(self, image_paths):
+        # Thumbnail của ảnh đã xóa/đã sửa không bao giờ được dùng lại: xóa hết,
+        # rồi giữ tổng dung lượng dưới trần, bỏ file lâu không dùng nhất trước.
+        valid = set()
+        for img_path in image_paths:
+            try:
+                valid.add(os.path.basename(self._disk_path(img_path)))
+            except OSError:
+                pass
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith('.tmp'):
+                    continue # Worker đang ghi dở
+                if entry.name not in valid:
+                    os.remove(entry.path)
+                else:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= THUMB_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _load(self, img_path):
+        disk_path = self._disk_path(img_path)
+        if os.path.exists(disk_path):
+            with Image.open(disk_path) as cached:
+                cached.load()
+                thumb = cached.copy()
+            try:
+                os.utime(disk_path) # Đánh dấu vừa dùng để prune giữ lại
+            except OSError:
+                pass
+            return thumb
+        with Image.open(img_path) as img:
+            img.draft('RGB', THUMB_SIZE) # JPEG: decode luôn ở độ phân giải thấp, nhanh hơn nhiều
+            img.thumbnail(THUMB_SIZE)
+            thumb = img.convert('RGB')
+        tmp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+        thumb.save(tmp_path, 'JPEG', quality=90)
+        os.replace(tmp_path, disk_path)
+        return thumb
+
+    def _remember(self, img_path, thumb):
+        with self.lock:
+            self.memory[img_path] = thumb
+            self.memory.move_to_end(img_path)
+            while len(self.memory) > MEMORY_CACHE_SIZE:
+                self.memory.popitem(last=False)
+
+    def _worker(self):
+        while True:
+            img_path = self.requests.get()
+            with self.lock:
+                # Người dùng đã lướt qua chỗ khác thì bỏ request cũ
+                if img_path not in self.wanted or img_path in self.memory:
+                    continue
+            try:
+                self._remember(img_path, self._load(img_path))
+            except Exception:
+                pass
+
+    def prefetch(self, paths):
+        with self.lock:
+            self.wanted = set(paths)
+        for img_path in paths:
+            self.requests.put(img_path)
+
+    def get(self, img_path):
+        with self.lock:
+            thumb = self.memory.get(img_path)
+            if thumb is not None:
+                self.memory.move_to_end(img_path)
+                return thumb
+        # Chưa prefetch kịp thì load luôn trên thread UI (vẫn dùng cache đĩa)
+        thumb = self._load(img_path)
+        self._remember(img_path, thumb)
+        return thumb
+
 class DatasetReviewer:
     def __init__(self, root, folder_path):
         self.root = root
@@ -13,7 +129,7 @@ class DatasetReviewer:
         # Lấy danh sách ảnh
         self.image_list = [f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
         self.current_idx = 0
-        self.deleted_list = [] # Danh sách các ảnh tạm đánh dấu xóa
+        self.deleted_set = set() # Các ảnh tạm đánh dấu xóa (set cho check O(1))
 
         if not self.image_list:
             messagebox.showerror("Lỗi", "Thư mục không có ảnh nào bro ơi!")
@@ -41,22 +157,33 @@ class DatasetReviewer:
         root.bind("<Right>", lambda e: self.next_img())
         root.bind("<Delete>", lambda e: self.mark_delete())
 
+        self.loader = ThumbnailLoader(folder_path, [os.path.join(folder_path, name) for name in self.image_list])
         self.show_image()
 
+    def prefetch_around(self):
+        # Ưu tiên ảnh gần nhất trước: +1, -1, +2, -2, ...
+        paths = []
+        for step in range(1, PREFETCH_AHEAD + 1):
+            for idx in (self.current_idx + step, self.current_idx - step):
+                if 0 <= idx < len(self.image_list):
+                    paths.append(os.path.join(self.folder_path, self.image_list[idx]))
+        self.loader.prefetch(paths)
+
     def show_image(self):
         if 0 <= self.current_idx < len(self.image_list):
             img_name = self.image_list[self.current_idx]
             img_path = os.path.join(self.folder_path, img_name)
             
             # Cập nhật thông tin
-            status = "[ĐÃ ĐÁNH DẤU XÓA]" if img_name in self.deleted_list else ""
+            status = "[ĐÃ ĐÁNH DẤU XÓA]" if img_name in self.deleted_set else ""
             self.label_info.config(text=f"Ảnh {self.current_idx + 1}/{len(self.image_list)}: {img_name} {status}")
 
-            # Load và resize ảnh hiển thị
-            img = Image.open(img_path)
-            img.thumbnail((500, 500))
+            # Lấy thumbnail đã prefetch sẵn (nếu có) rồi load trước các ảnh xung quanh
+            img = self.loader.get(img_path)
             self.tk_img = ImageTk.PhotoImage(img)
+            self.canvas.delete("all")
             self.canvas.create_image(250, 250, image=self.tk_img)
+            self.prefetch_around()
 
     def next_img(self):
         if self.current_idx < len(self.image_list) - 1:
@@ -70,23 +197,23 @@ class DatasetReviewer:
 
     def mark_delete(self):
         img_name = self.image_list[self.current_idx]
-        if img_name not in self.deleted_list:
-            self.deleted_list.append(img_name)
+        if img_name not in self.deleted_set:
+            self.deleted_set.add(img_name)
             print(f"Đã đánh dấu xóa: {img_name}")
         else:
-            self.deleted_list.remove(img_name) # Nhấn lần nữa để hoàn tác
+            self.deleted_set.discard(img_name) # Nhấn lần nữa để hoàn tác
             print(f"Đã hoàn tác: {img_name}")
         self.show_image()
 
     def final_confirm(self):
-        if not self.deleted_list:
+        if not self.deleted_set:
             messagebox.showinfo("Xong", "Không có ảnh nào bị xóa. Bye bro!")
             self.root.destroy()
             return
 
-        confirm = messagebox.askyesno("Xác nhận lần cuối", f"Bro chắc chắn muốn quăng {len(self.deleted_list)} ảnh vào thùng rác chứ?")
+        confirm = messagebox.askyesno("Xác nhận lần cuối", f"Bro chắc chắn muốn quăng {len(self.deleted_set)} ảnh vào thùng rác chứ?")
         if confirm:
-            for img_name in self.deleted_list:
+            for img_name in sorted(self.deleted_set):
                 full_path = os.path.join(self.folder_path, img_name)
                 send2trash(full_path) # Đưa vào thùng rác thật của Windows
             messagebox.showinfo("Thành công", "Đã dọn dẹp xong dataset!")
@@ -2,6 +2,7 @@ console.log("!!! SERVER SCRIPT STARTING !!!");
 require("dotenv").config();
 const express = require("express");
 const fs = require("fs");
+const crypto = require("crypto");
 const path = require("path");
 const cors = require("cors");
 const { spawn } = require("child_process");
@@ -48,10 +49,22 @@ const BACKEND_DIR = path.join(__dirname, "backend");
 const FACE_DIR = path.join(BACKEND_DIR, "face");
 const FACE_ENGINE_PATH = path.join(FACE_DIR, "face_engine.py");
 const TRAIN_SCRIPT_PATH = path.join(FACE_DIR, "train_faces.py");
+const GALLERY_VERSIONS_PATH = path.join(FACE_DIR, "gallery_versions.py");
 const TMP_DIR = process.env.VERCEL ? os.tmpdir() : FACE_DIR;
 const TEMP_IMAGE_PATH = path.join(TMP_DIR, "temp.jpg");
 const TEMP_DETECT_PATH = path.join(TMP_DIR, "temp_detect.jpg");
 const PYTHON_BIN = process.env.PYTHON_BIN || "python";
+const TRAIN_JOBS_DIR = path.join(TMP_DIR, "train_jobs");
+const TRAIN_JOB_RETENTION_MS = Number(process.env.TRAIN_JOB_RETENTION_MS || 7 * 24 * 60 * 60 * 1000);
+const FACE_PROFILE_DIR = process.env.FACE_PROFILE_DIR || path.join(FACE_DIR, "profiles");
+const FACE_ENCODINGS_PATH = path.join(FACE_DIR, "face_encodings.json");
+// Single source for the match cutoff: face_engine.py reads the same variable,
+// and spawned Python processes inherit it from process.env.
+const FACE_MATCH_THRESHOLD = Number(process.env.FACE_MATCH_THRESHOLD || 0.5);
+process.env.FACE_MATCH_THRESHOLD = String(FACE_MATCH_THRESHOLD);
+const EMBEDDING_DIM = 128;
+const DETECTION_CACHE_MAX = Number(process.env.FACE_DETECTION_CACHE_MAX || 64);
+const DETECTION_TTL_MS = Number(process.env.FACE_DETECTION_TTL_MS || 15000);
 
 function ensureDir(dirPath) {
   if (!fs.existsSync(dirPath)) {
@@ -60,6 +73,33 @@ function ensureDir(dirPath) {
 }
 
 
+const NDJSON_CHUNK_BYTES = 1024 * 1024;
+
+// One JSON document per line: train_faces.py streams it instead of loading
+// the whole roster. Lines are batched into ~1MB chunks, so a large roster
+// takes a handful of writes rather than one syscall per student, and no
+// single giant string is built either.
+function writeNdjsonFile(filePath, items) {
+  const fd = fs.openSync(filePath, "w");
+  try {
+    let chunk = [];
+    let chunkBytes = 0;
+    items.forEach(item => {
+      const line = `${JSON.stringify(item)}\n`;
+      chunk.push(line);
+      chunkBytes += line.length;
+      if (chunkBytes >= NDJSON_CHUNK_BYTES) {
+        fs.writeSync(fd, chunk.join(""), null, "utf-8");
+        chunk = [];
+        chunkBytes = 0;
+      }
+    });
+    if (chunk.length) fs.writeSync(fd, chunk.join(""), null, "utf-8");
+  } finally {
+    fs.closeSync(fd);
+  }
+}
+
 function buildCsvRow(values) {
   return values
     .map(value => {
@@ -155,14 +195,6 @@ function runPythonInline(code) {
   });
 }
 
-function saveBase64Image(dataUrl, filePath) {
-  const match = typeof dataUrl === "string" ? dataUrl.match(/^data:image\/\w+;base64,(.+)$/) : null;
-  if (!match) return null;
-  const buffer = Buffer.from(match[1], "base64");
-  fs.writeFileSync(filePath, buffer);
-  return filePath;
-}
-
 function isValidHttpUrl(value) {
   if (!value || typeof value !== "string") return false;
   try {
@@ -199,7 +231,9 @@ function normalizeClassDeleteError(error) {
 
 function warmupPython() {
   try {
-    const child = spawn(PYTHON_BIN, [FACE_ENGINE_PATH], { cwd: __dirname });
+    // Loads dlib, the face models and the gallery into the OS page cache so the
+    // first real /api/face/verify does not pay the cold-start import cost.
+    const child = spawn(PYTHON_BIN, [FACE_ENGINE_PATH, "--prewarm"], { cwd: __dirname });
     child.on("error", () => { });
   } catch (e) {
     console.error("Python warmup failed:", e.message);
@@ -760,7 +794,16 @@ app.get("/api/face/train/candidates", async (req, res) => {
   }
 });
 
+// Set while the synchronous /api/face/train route runs, so it and the
+// background jobs never write face_encodings.json at the same time.
+let syncTrainRunning = false;
+
 app.post("/api/face/train", async (req, res) => {
+  const conflict = trainingConflict();
+  if (conflict) {
+    return res.status(409).json(conflict);
+  }
+  syncTrainRunning = true;
   let trainInputPath = null;
   try {
     ensureDir(FACE_DIR);
@@ -776,12 +819,8 @@ app.post("/api/face/train", async (req, res) => {
       });
     }
 
-    trainInputPath = path.join(TMP_DIR, `train_input_${Date.now()}.json`);
-    fs.writeFileSync(
-      trainInputPath,
-      JSON.stringify({ students: candidates }, null, 2),
-      { encoding: "utf-8" }
-    );
+    trainInputPath = path.join(TMP_DIR, `train_input_${Date.now()}.ndjson`);
+    writeNdjsonFile(trainInputPath, candidates);
 
     const { stdout } = await runPython(TRAIN_SCRIPT_PATH, [trainInputPath]);
     const payload = safeParseEngineJson(stdout);
@@ -796,6 +835,7 @@ app.post("/api/face/train", async (req, res) => {
       message: error.message
     });
   } finally {
+    syncTrainRunning = false;
     if (trainInputPath && fs.existsSync(trainInputPath)) {
       try {
         fs.unlinkSync(trainInputPath);
@@ -806,27 +846,334 @@ app.post("/api/face/train", async (req, res) => {
   }
 });
 
+const trainJobs = new Map();
+
+function trainJobDir(jobId) {
+  return path.join(TRAIN_JOBS_DIR, jobId);
+}
+
+function publicTrainJob(job) {
+  const { child, listeners, ...state } = job;
+  return state;
+}
+
+function saveTrainJobState(job) {
+  job.updated_at = new Date().toISOString();
+  try {
+    fs.writeFileSync(
+      path.join(trainJobDir(job.id), "job.json"),
+      JSON.stringify(publicTrainJob(job)),
+      { encoding: "utf-8" }
+    );
+  } catch (error) {
+    console.error("Failed to save train job state:", error.message);
+  }
+}
+
+function loadTrainJob(jobId) {
+  if (trainJobs.has(jobId)) return trainJobs.get(jobId);
+  if (!/^[\w-]+$/.test(jobId)) return null;
+  const statePath = path.join(trainJobDir(jobId), "job.json");
+  if (!fs.existsSync(statePath)) return null;
+  try {
+    const state = JSON.parse(fs.readFileSync(statePath, "utf-8"));
+    // A job that was running when the server stopped can be resumed from its checkpoint.
+    if (state.status === "running") state.status = "interrupted";
+    const job = { ...state, child: null, listeners: new Set() };
+    trainJobs.set(jobId, job);
+    return job;
+  } catch (error) {
+    return null;
+  }
+}
+
+function findRunningTrainJob() {
+  for (const job of trainJobs.values()) {
+    if (job.status === "running") return job;
+  }
+  return null;
+}
+
+function trainingConflict() {
+  if (syncTrainRunning) {
+    return { status: "fail", message: "Đang có một tiến trình huấn luyện chạy." };
+  }
+  const running = findRunningTrainJob();
+  if (running) {
+    return {
+      status: "fail",
+      message: "Đang có một tiến trình huấn luyện chạy.",
+      job: publicTrainJob(running)
+    };
+  }
+  return null;
+}
+
+// Completed and cancelled jobs keep their roster and checkpoint on disk only
+// for TRAIN_JOB_RETENTION_MS; failed or interrupted jobs stay resumable.
+function pruneTrainJobs(now = Date.now()) {
+  if (!fs.existsSync(TRAIN_JOBS_DIR)) return;
+  fs.readdirSync(TRAIN_JOBS_DIR).forEach(jobId => {
+    const job = loadTrainJob(jobId);
+    if (!job || (job.status !== "completed" && job.status !== "cancelled")) return;
+    const finishedAt = Date.parse(job.updated_at || job.created_at);
+    if (!(now - finishedAt > TRAIN_JOB_RETENTION_MS)) return;
+    try {
+      fs.rmSync(trainJobDir(jobId), { recursive: true, force: true });
+      trainJobs.delete(jobId);
+    } catch (error) {
+      console.error("Failed to prune train job:", error.message);
+    }
+  });
+}
+
+function broadcastTrainJob(job, event) {
+  const line = `${JSON.stringify(event)}\n`;
+  job.listeners.forEach(listener => listener.write(line));
+}
+
+function handleTrainJobLine(job, line) {
+  const trimmed = line.trim();
+  if (!trimmed) return;
+  let event;
+  try {
+    event = JSON.parse(trimmed);
+  } catch (error) {
+    return;
+  }
+  if (event.event === "progress") {
+    job.progress = event;
+    saveTrainJobState(job);
+    broadcastTrainJob(job, event);
+    return;
+  }
+  job.result = event;
+}
+
+function runTrainJob(job) {
+  const jobDir = trainJobDir(job.id);
+  // Jobs created before the NDJSON roster still have train_input.json.
+  const ndjsonInput = path.join(jobDir, "train_input.ndjson");
+  const trainInput = fs.existsSync(ndjsonInput) ? ndjsonInput : path.join(jobDir, "train_input.json");
+  const child = spawn(
+    PYTHON_BIN,
+    [TRAIN_SCRIPT_PATH, trainInput, "--job-dir", jobDir, "--progress"],
+    { cwd: __dirname }
+  );
+  job.child = child;
+  job.status = "running";
+  job.error = null;
+  job.attempts = (job.attempts || 0) + 1;
+  saveTrainJobState(job);
+  broadcastTrainJob(job, { event: "status", ...publicTrainJob(job) });
+
+  let pending = "";
+  let stderr = "";
+  child.stdout.on("data", chunk => {
+    pending += chunk.toString();
+    const lines = pending.split(/\r?\n/);
+    pending = lines.pop();
+    lines.forEach(line => handleTrainJobLine(job, line));
+  });
+  child.stderr.on("data", chunk => {
+    stderr = (stderr + chunk.toString()).slice(-4000);
+  });
+
+  let finished = false;
+  const finish = (status, error) => {
+    if (finished) return;
+    finished = true;
+    handleTrainJobLine(job, pending);
+    job.child = null;
+    if (job.status !== "cancelled") {
+      job.status = status;
+      job.error = error || null;
+    }
+    saveTrainJobState(job);
+    broadcastTrainJob(job, { event: "end", ...publicTrainJob(job) });
+    job.listeners.forEach(listener => listener.end());
+    job.listeners.clear();
+  };
+
+  child.on("error", error => finish("failed", error.message));
+  child.on("close", code => {
+    if (code === 0 && job.result && job.result.status === "success") {
+      return finish("completed");
+    }
+    return finish("failed", stderr || `Python exit ${code}`);
+  });
+}
+
+app.post("/api/face/train/jobs", async (req, res) => {
+  try {
+    const conflict = trainingConflict();
+    if (conflict) {
+      return res.status(409).json(conflict);
+    }
+    pruneTrainJobs();
+
+    const students = await studentService.listStudents();
+    const candidates = normalizeTrainCandidates(students);
+    if (!candidates.length) {
+      return res.status(400).json({
+        status: "fail",
+        message: "Không có học sinh nào có avatar URL hợp lệ để huấn luyện.",
+        total_students: students.length,
+        eligible_students: 0
+      });
+    }
+
+    const jobId = `train_${Date.now()}`;
+    ensureDir(trainJobDir(jobId));
+    writeNdjsonFile(path.join(trainJobDir(jobId), "train_input.ndjson"), candidates);
+
+    const job = {
+      id: jobId,
+      status: "queued",
+      created_at: new Date().toISOString(),
+      total_students: students.length,
+      eligible_students: candidates.length,
+      attempts: 0,
+      progress: null,
+      result: null,
+      error: null,
+      child: null,
+      listeners: new Set()
+    };
+    trainJobs.set(jobId, job);
+    runTrainJob(job);
+    return res.status(202).json(publicTrainJob(job));
+  } catch (error) {
+    return res.status(500).json({ status: "error", message: error.message });
+  }
+});
+
+app.get("/api/face/train/jobs/:id", (req, res) => {
+  const job = loadTrainJob(req.params.id);
+  if (!job) {
+    return res.status(404).json({ status: "fail", message: "Train job not found" });
+  }
+  return res.json(publicTrainJob(job));
+});
+
+app.get("/api/face/train/jobs/:id/events", (req, res) => {
+  const job = loadTrainJob(req.params.id);
+  if (!job) {
+    return res.status(404).json({ status: "fail", message: "Train job not found" });
+  }
+  res.setHeader("Content-Type", "application/x-ndjson; charset=utf-8");
+  res.setHeader("Cache-Control", "no-cache");
+  res.write(`${JSON.stringify({ event: "status", ...publicTrainJob(job) })}\n`);
+  if (job.status !== "running") {
+    return res.end();
+  }
+  job.listeners.add(res);
+  req.on("close", () => job.listeners.delete(res));
+  return undefined;
+});
+
+app.post("/api/face/train/jobs/:id/cancel", (req, res) => {
+  const job = loadTrainJob(req.params.id);
+  if (!job) {
+    return res.status(404).json({ status: "fail", message: "Train job not found" });
+  }
+  if (job.status !== "running" || !job.child) {
+    return res.status(409).json({ status: "fail", message: "Train job is not running", job: publicTrainJob(job) });
+  }
+  job.status = "cancelled";
+  job.child.kill("SIGTERM");
+  saveTrainJobState(job);
+  return res.json(publicTrainJob(job));
+});
+
+app.post("/api/face/train/jobs/:id/resume", (req, res) => {
+  const job = loadTrainJob(req.params.id);
+  if (!job) {
+    return res.status(404).json({ status: "fail", message: "Train job not found" });
+  }
+  if (job.status === "running" || job.status === "completed") {
+    return res.status(409).json({ status: "fail", message: `Train job is ${job.status}`, job: publicTrainJob(job) });
+  }
+  const conflict = trainingConflict();
+  if (conflict) {
+    return res.status(409).json(conflict);
+  }
+  runTrainJob(job);
+  return res.status(202).json(publicTrainJob(job));
+});
+
+// Frames that /api/face/detect found a face in, keyed by a short-lived handle,
+// so /api/face/verify can encode the known box instead of detecting again.
+// Bounded by count (oldest first) and by TTL.
+const detectionCache = new Map();
+
+function sweepDetectionCache(now = Date.now()) {
+  for (const [handle, entry] of detectionCache) {
+    if (entry.expiresAt <= now) detectionCache.delete(handle);
+  }
+  while (detectionCache.size > DETECTION_CACHE_MAX) {
+    detectionCache.delete(detectionCache.keys().next().value);
+  }
+}
+
+function rememberDetection(imageBuffer, boxes) {
+  const handle = crypto.randomBytes(12).toString("hex");
+  detectionCache.set(handle, { image: imageBuffer, boxes, expiresAt: Date.now() + DETECTION_TTL_MS });
+  sweepDetectionCache();
+  return handle;
+}
+
+function takeDetection(handle) {
+  sweepDetectionCache();
+  const entry = typeof handle === "string" ? detectionCache.get(handle) : null;
+  // Single use: a handle is consumed by the verify that references it.
+  if (entry) detectionCache.delete(handle);
+  return entry || null;
+}
+
+function normalizeFaceBox(box) {
+  if (!Array.isArray(box) || box.length !== 4) return null;
+  const values = box.map(Number);
+  if (!values.every(Number.isFinite)) return null;
+  const [top, right, bottom, left] = values.map(Math.round);
+  if (top < 0 || left < 0 || bottom <= top || right <= left) return null;
+  return [top, right, bottom, left];
+}
+
+function largestFaceBox(boxes) {
+  return boxes.reduce((best, box) => {
+    const area = (box[2] - box[0]) * (box[1] - box[3]);
+    const bestArea = best ? (best[2] - best[0]) * (best[1] - best[3]) : -1;
+    return area > bestArea ? box : best;
+  }, null);
+}
+
 app.post("/api/face/detect", async (req, res) => {
   try {
     ensureDir(FACE_DIR);
-    const imageData = req.body && req.body.image;
-    if (!imageData) {
-      return res.json({ hasFace: false });
-    }
-    const saved = saveBase64Image(imageData, TEMP_DETECT_PATH);
-    if (!saved) {
+    const imageBuffer = parseDataUrlImage(req.body && req.body.image);
+    if (!imageBuffer) {
       return res.json({ hasFace: false });
     }
+    fs.writeFileSync(TEMP_DETECT_PATH, imageBuffer);
     const script = `
 import json
 import face_recognition
 image = face_recognition.load_image_file(r"${TEMP_DETECT_PATH}")
 locs = face_recognition.face_locations(image)
-print(json.dumps({"hasFace": bool(locs)}))
+print(json.dumps({"hasFace": bool(locs), "boxes": [list(loc) for loc in locs]}))
 `;
     const { stdout } = await runPythonInline(script);
     const payload = safeParseEngineJson(stdout);
-    return res.json(payload);
+    if (!payload.hasFace) {
+      return res.json({ hasFace: false });
+    }
+    return res.json({
+      hasFace: true,
+      boxes: payload.boxes,
+      handle: rememberDetection(imageBuffer, payload.boxes),
+      expires_in_ms: DETECTION_TTL_MS
+    });
   } catch (error) {
     return res.json({ hasFace: false });
   }
@@ -851,11 +1198,65 @@ app.post("/api/face/debug", (req, res) => {
   }
 });
 
+async function respondRecognition(res, result, date) {
+  if (result.status === "success") {
+    const saved = await appendAttendance(result, date);
+    sendToArduino({
+      status: "Y",
+      name: result.full_name,
+      class: result.class_name
+    });
+    console.log("Y", result.full_name, result.class_name);
+    return res.json({
+      status: "success",
+      student_code: result.student_code,
+      full_name: result.full_name,
+      class_name: result.class_name,
+      confidence: result.confidence,
+      profile_id: result.profile_id,
+      student: saved ? saved.student : null,
+      attendance: saved ? saved.attendance : null
+    });
+  }
+
+  sendToArduino({ status: "N" });
+  console.log("N");
+  return res.json(result);
+}
+
 app.post("/api/face/verify", async (req, res) => {
   try {
     ensureDir(FACE_DIR);
-
-    const imageBuffer = parseDataUrlImage(req.body && req.body.image);
+    const body = req.body || {};
+
+    // Preferred: the handle from /api/face/detect (frame + boxes already known).
+    // Otherwise an image, optionally with an explicit [top, right, bottom, left] box.
+    let imageBuffer = null;
+    let box = null;
+    if (body.handle) {
+      const detection = takeDetection(body.handle);
+      if (detection) {
+        imageBuffer = detection.image;
+        box = largestFaceBox(detection.boxes);
+      } else if (!body.image) {
+        return res.status(410).json({
+          status: "fail",
+          message: "Detection handle expired, send the image again"
+        });
+      }
+    }
+    if (!imageBuffer) {
+      imageBuffer = parseDataUrlImage(body.image);
+      if (body.box !== undefined) {
+        box = normalizeFaceBox(body.box);
+        if (!box) {
+          return res.status(400).json({
+            status: "fail",
+            message: "Invalid face box, expected [top, right, bottom, left]"
+          });
+        }
+      }
+    }
     if (!imageBuffer) {
       return res.status(400).json({
         status: "fail",
@@ -864,31 +1265,13 @@ app.post("/api/face/verify", async (req, res) => {
     }
 
     fs.writeFileSync(TEMP_IMAGE_PATH, imageBuffer);
-    const { stdout } = await runPython(FACE_ENGINE_PATH, [TEMP_IMAGE_PATH]);
+    const engineArgs = [TEMP_IMAGE_PATH];
+    if (box) engineArgs.push("--box", box.join(","));
+    // Opt-in per request: the engine runs under cProfile and returns profile_id.
+    if (body.profile === true || req.get("x-face-profile") === "1") engineArgs.push("--profile");
+    const { stdout } = await runPython(FACE_ENGINE_PATH, engineArgs);
     const result = safeParseEngineJson(stdout);
-
-    if (result.status === "success") {
-      const saved = await appendAttendance(result, req.body && req.body.date);
-      sendToArduino({
-        status: "Y",
-        name: result.full_name,
-        class: result.class_name
-      });
-      console.log("Y", result.full_name, result.class_name);
-      return res.json({
-        status: "success",
-        student_code: result.student_code,
-        full_name: result.full_name,
-        class_name: result.class_name,
-        confidence: result.confidence,
-        student: saved ? saved.student : null,
-        attendance: saved ? saved.attendance : null
-      });
-    }
-
-    sendToArduino({ status: "N" });
-    console.log("N");
-    return res.json(result);
+    return respondRecognition(res, result, body.date);
   } catch (error) {
     sendToArduino({ status: "N" });
     console.log("N");
@@ -896,12 +1279,203 @@ app.post("/api/face/verify", async (req, res) => {
   }
 });
 
+// Embedding-only verify for edge kiosks (backend/face/edge_client.py): the
+// kiosk detects and encodes locally and sends the 128-d float32 vector, so the
+// server only matches. The gallery is kept in memory and reloaded when
+// face_encodings.json changes.
+let embeddingGallery = { mtimeMs: -1, items: [], matrix: new Float64Array(0) };
+
+function loadEmbeddingGallery() {
+  const stat = fs.statSync(FACE_ENCODINGS_PATH);
+  if (stat.mtimeMs === embeddingGallery.mtimeMs) return embeddingGallery;
+  const records = JSON.parse(fs.readFileSync(FACE_ENCODINGS_PATH, "utf-8"))
+    .filter(item => Array.isArray(item.encoding) && item.encoding.length === EMBEDDING_DIM);
+  const matrix = new Float64Array(records.length * EMBEDDING_DIM);
+  const items = records.map((item, row) => {
+    matrix.set(item.encoding, row * EMBEDDING_DIM);
+    const { encoding, ...meta } = item;
+    return meta;
+  });
+  embeddingGallery = { mtimeMs: stat.mtimeMs, items, matrix };
+  return embeddingGallery;
+}
+
+function decodeEmbedding(buffer) {
+  if (!Buffer.isBuffer(buffer) || buffer.length !== EMBEDDING_DIM * 4) return null;
+  const embedding = new Float64Array(EMBEDDING_DIM);
+  for (let i = 0; i < EMBEDDING_DIM; i += 1) {
+    embedding[i] = buffer.readFloatLE(i * 4);
+  }
+  return embedding.every(Number.isFinite) ? embedding : null;
+}
+
+function matchEmbedding(embedding) {
+  const { items, matrix } = loadEmbeddingGallery();
+  let bestIndex = -1;
+  let bestDistance = Infinity;
+  for (let row = 0; row < items.length; row += 1) {
+    const offset = row * EMBEDDING_DIM;
+    let sum = 0;
+    for (let i = 0; i < EMBEDDING_DIM; i += 1) {
+      const diff = matrix[offset + i] - embedding[i];
+      sum += diff * diff;
+    }
+    if (sum < bestDistance) {
+      bestDistance = sum;
+      bestIndex = row;
+    }
+  }
+  bestDistance = Math.sqrt(bestDistance);
+  if (bestIndex < 0 || bestDistance >= FACE_MATCH_THRESHOLD) {
+    return { status: "fail", message: "No match found" };
+  }
+  const item = items[bestIndex];
+  return {
+    status: "success",
+    student_code: item.student_code || "",
+    full_name: item.full_name || "",
+    class_name: item.class_name || "",
+    confidence: Math.round(Math.max(0, 1 - bestDistance) * 100) / 100
+  };
+}
+
+// Binary: application/octet-stream body of 512 bytes (128 little-endian
+// float32) and the box in X-Face-Box "top,right,bottom,left"; ?date= optional.
+// JSON: { embedding: "<base64 float32>", box, date }.
+app.post(
+  "/api/face/verify/embedding",
+  express.raw({ type: "application/octet-stream", limit: "4kb" }),
+  async (req, res) => {
+    try {
+      const binary = Buffer.isBuffer(req.body);
+      const body = binary ? {} : (req.body || {});
+      const raw = binary
+        ? req.body
+        : (typeof body.embedding === "string" ? Buffer.from(body.embedding, "base64") : null);
+      const embedding = decodeEmbedding(raw);
+      if (!embedding) {
+        return res.status(400).json({
+          status: "fail",
+          message: `Expected ${EMBEDDING_DIM} float32 values (${EMBEDDING_DIM * 4} bytes)`
+        });
+      }
+      const boxValue = binary ? req.get("x-face-box") : body.box;
+      if (boxValue !== undefined && !normalizeFaceBox(typeof boxValue === "string" ? boxValue.split(",") : boxValue)) {
+        return res.status(400).json({
+          status: "fail",
+          message: "Invalid face box, expected [top, right, bottom, left]"
+        });
+      }
+      if (!fs.existsSync(FACE_ENCODINGS_PATH)) {
+        return res.json({ status: "fail", message: "face_encodings.json not found" });
+      }
+      const result = matchEmbedding(embedding);
+      return respondRecognition(res, result, binary ? req.query.date : body.date);
+    } catch (error) {
+      sendToArduino({ status: "N" });
+      console.log("N");
+      return res.status(500).json({ status: "fail", message: error.message });
+    }
+  }
+);
+
+// Offline kiosks (backend/face/kiosk_offline.py) pull only the gallery records
+// changed or removed since the generation they hold.
+app.get("/api/face/gallery/delta", async (req, res) => {
+  try {
+    const since = Number.parseInt(req.query.since, 10) || 0;
+    const field = typeof req.query.field === "string" ? req.query.field : "";
+    const value = typeof req.query.value === "string" ? req.query.value : "";
+    if (since < 0 || (field && !/^\w+$/.test(field))) {
+      return res.status(400).json({ status: "fail", message: "Invalid since or field" });
+    }
+    const args = ["delta", "--since", String(since)];
+    if (field) args.push("--field", field, "--value", value);
+    const { stdout } = await runPython(GALLERY_VERSIONS_PATH, args);
+    return res.json(safeParseEngineJson(stdout));
+  } catch (error) {
+    return res.status(500).json({ status: "error", message: error.message });
+  }
+});
+
+// Attendance matched on a kiosk while it was offline, replayed in order. The
+// kiosk drops the first `accepted` events from its spool; a database failure
+// stops the batch with 503 so the rest is retried later.
+app.post("/api/face/attendance/bulk", async (req, res) => {
+  const events = req.body && Array.isArray(req.body.events) ? req.body.events : null;
+  if (!events) {
+    return res.status(400).json({ status: "fail", message: "events must be an array" });
+  }
+  let accepted = 0;
+  let recorded = 0;
+  const unknown = [];
+  for (const event of events) {
+    if (event && event.student_code) {
+      try {
+        const saved = await appendAttendance(
+          { student_code: event.student_code, confidence: event.confidence },
+          event.date
+        );
+        if (saved) recorded += 1;
+        else unknown.push(event.student_code);
+      } catch (error) {
+        return res.status(503).json({ status: "error", message: error.message, accepted, recorded, unknown });
+      }
+    }
+    accepted += 1;
+  }
+  console.log(`[KIOSK] ${req.body.kiosk_id || "unknown"} replayed ${recorded}/${events.length} attendance events`);
+  return res.json({ status: "success", accepted, recorded, unknown });
+});
+
+app.get("/api/face/profiles", (req, res) => {
+  try {
+    if (!fs.existsSync(FACE_PROFILE_DIR)) {
+      return res.json({ profiles: [] });
+    }
+    const profiles = fs.readdirSync(FACE_PROFILE_DIR)
+      .filter(name => name.endsWith(".pstats"))
+      .map(name => {
+        const stat = fs.statSync(path.join(FACE_PROFILE_DIR, name));
+        return {
+          id: name.replace(/\.pstats$/, ""),
+          size: stat.size,
+          created_at: stat.mtime.toISOString()
+        };
+      })
+      .sort((a, b) => b.created_at.localeCompare(a.created_at));
+    return res.json({ profiles });
+  } catch (error) {
+    return res.status(500).json({ status: "error", message: error.message });
+  }
+});
+
+app.get("/api/face/profiles/:id", (req, res) => {
+  const { id } = req.params;
+  if (!/^[\w-]+$/.test(id)) {
+    return res.status(400).json({ status: "fail", message: "Invalid profile id" });
+  }
+  // ?format=pstats downloads the raw cProfile dump for snakeviz/pstats;
+  // the default is the text summary sorted by cumulative time.
+  const raw = req.query.format === "pstats";
+  const filePath = path.join(FACE_PROFILE_DIR, `${id}.${raw ? "pstats" : "txt"}`);
+  if (!fs.existsSync(filePath)) {
+    return res.status(404).json({ status: "fail", message: "Profile not found" });
+  }
+  if (raw) {
+    return res.download(filePath, `${id}.pstats`);
+  }
+  res.type("text/plain; charset=utf-8");
+  return res.send(fs.readFileSync(filePath, "utf-8"));
+});
+
 // Xuất app để Vercel serverless function có thể gọi
 if (require.main === module) {
   const PORT = process.env.PORT || 5000;
   const server = app.listen(PORT, () => {
     console.log(`Server running at http://localhost:${PORT}`);
     warmupPython();
+    pruneTrainJobs();
   });
 
   server.on("error", err => {
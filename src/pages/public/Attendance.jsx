@@ -172,6 +172,7 @@ export default function Attendance() {
   const cooldownUntilRef = useRef(0);       // timestamp until cooldown ends
   const inFlightRef = useRef({ detect: false, verify: false });
   const lastFaceRef = useRef(false);
+  const lastDetectHandleRef = useRef(null); // handle from the last /api/face/detect that found a face
   const successTimerRef = useRef(null);
 
   /* ── Roster refs ── */
@@ -208,6 +209,7 @@ export default function Attendance() {
   const resetTransient = useCallback(() => {
     confirmStartRef.current = null;
     lastFaceRef.current = false;
+    lastDetectHandleRef.current = null;
     cooldownUntilRef.current = 0;
     inFlightRef.current.detect = false;
     inFlightRef.current.verify = false;
@@ -301,7 +303,7 @@ export default function Attendance() {
   /* ──────────────────────────────────────────────
      Phase 2+3: Verify with backend then cooldown
      ────────────────────────────────────────────── */
-  const doVerify = useCallback(async (base64) => {
+  const doVerify = useCallback(async (base64, handle) => {
     inFlightRef.current.verify = true;
     setScanProgress(80);
     setScanStatusMsg("Đang xác thực với AI Engine...");
@@ -312,7 +314,9 @@ export default function Attendance() {
       {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ image: base64, date: selectedDateRef.current }),
+        // The handle lets the server reuse the frame and box it just detected;
+        // the image is the fallback if the handle has already expired.
+        body: JSON.stringify({ handle: handle || undefined, image: base64, date: selectedDateRef.current }),
       },
       log
     );
@@ -402,6 +406,7 @@ export default function Attendance() {
         log("[DEBUG] Face lost. Resetting timer.", "warn");
       }
       lastFaceRef.current = false;
+      lastDetectHandleRef.current = null;
       confirmStartRef.current = null;
       setScanProgress(0);
       setScanStatusMsg("Chưa phát hiện khuôn mặt, vui lòng đứng vào khung...");
@@ -414,6 +419,7 @@ export default function Attendance() {
       log("[DEBUG] Face detected. Stabilizing for 3s...", "info");
     }
     lastFaceRef.current = true;
+    lastDetectHandleRef.current = detectResult.data?.handle || null;
 
     if (!confirmStartRef.current) {
       confirmStartRef.current = now;
@@ -429,7 +435,9 @@ export default function Attendance() {
       // 3 seconds stable → verify
       confirmStartRef.current = null;
       inFlightRef.current.detect = false;
-      await doVerify(base64);
+      const handle = lastDetectHandleRef.current;
+      lastDetectHandleRef.current = null; // handles are single use
+      await doVerify(base64, handle);
       return;
     }
 